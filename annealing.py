@@ -3,140 +3,386 @@
 
 from binarytree import BinaryTree
 import csvloader
+import modelfile
+from multitarget import MultiTargetTree
+import profiling
+import schedules
+import tracing
+# plotting is imported for compatibility, matplotlib is loaded when needed
+from plotting import plotResult
 
-import copy
 import math
-import matplotlib.pyplot as plt
-from matplotlib.font_manager import FontProperties
+import pickle
 import random
 import os
 import sys
 import getopt
 
+import numpy as np
+
 def simulatedAnnealing(csvData, paramToPredict, temperature=1000, maxDepth=20, 
-                       step=1):
-    # a list of all computed Mean Squared Errors
-    allMSE = []
-    # a list of all temperature values
-    allTemp = []
-   
-    # a list of decisions MSE, when a worse decision was chosen
-    worseDecisionMSE= []
-    # a list of decisions temperature, when a worse decision was chosen
-    worseDecisionTemp = []
+                       step=1, initialTree=None, finalTemperature=0, seed=None,
+                       checkpointPath=None, checkpointInterval=1000, 
+                       resume=False, schedule=None, stopCriteria=None,
+                       trace=None, logInterval=1.0, stats=None,
+                       sampleSize=None, sampleMethod="uniform",
+                       resampleInterval=None, weights=None, proposals=1):
+    ''' Search for a regression tree with the lowest MSE.
+    @param paramToPredict: parameter to predict or a list of them (one 
+    tree predicting all of them, see MultiTargetTree)
+    @param initialTree: FlatTree or a loaded model (Predictor) to start from
+    (default: random tree)
+    @param finalTemperature: annealing stops when temperature reaches it
+    @param seed: seed of the random generator
+    @param checkpointPath: file where the state of annealing is saved every
+    checkpointInterval steps and at the end
+    @param resume: continue from checkpointPath if it exists
+    @param schedule: cooling schedule (default: LinearSchedule(step)), see 
+    schedules module
+    @param stopCriteria: list of stop criteria (e.g. NoImprovementStop)
+    @param trace: tracing.Trace recording the run (default: every step,
+    Trace(0) turns tracing off)
+    @param logInterval: seconds between progress lines (None: no output)
+    @param stats: profiling.AnnealingStats collecting timers and counters of
+    the run (default: a new one, returned under 'stats')
+    @param sampleSize: score moves on a sample of this many rows first, only
+    moves which would be accepted on the sample are scored on all rows 
+    (default: all moves are scored on all rows)
+    @param sampleMethod: "uniform" or "stratified" (by the first 
+    parameter to predict), see csvloader.sampleRows
+    @param resampleInterval: steps after which a new sample is drawn 
+    (default: the sample is fixed)
+    @param weights: weights of parameters to predict in the combined MSE
+    (default: see multitarget.targetWeights)
+    @param proposals: number of candidate moves proposed in every step; 
+    they are scored together (BinaryTree.scoreMoves) and one of them is 
+    chosen by chooseMove'''
+    if seed is not None:
+        random.seed(seed)
+        
+    # MSE and temperature of steps and of chosen worse decisions
+    if trace is None:
+        trace = tracing.Trace()
+    progress = None
+    if logInterval is not None:
+        progress = tracing.ProgressLog(logInterval)
+    if stats is None:
+        stats = profiling.AnnealingStats()
     
     theWorstMSE = 0
     
-    # best fitting tree
-    bestTree = None
+    # best fitting tree (kept as a snapshot)
+    bestSnapshot = None
     bestMSE = None
     bestTreeTemp = None
     
     temp = temperature 
+    if schedule is None:
+        schedule = schedules.LinearSchedule(step)
+    stopwatch = schedules.Stopwatch(stopCriteria)
+    steps = 0
+    stepsSinceImprovement = 0
     # set initial tree
     BinaryTree.maxDepth = maxDepth
-    tree = BinaryTree(csvData, paramToPredict)
-    tree.generate()
-    tree.insertDataCollection(csvData)
-    tree.computeMeanLeavesValues()
-    treeMSE = tree.getMeanSquaredError()
+    tree = newTree(csvData, paramToPredict, weights)
+    state = None
+    if resume and checkpointPath and os.path.exists(checkpointPath):
+        state = loadCheckpoint(checkpointPath)
+        if (state["paramToPredict"] != paramToPredict or 
+            state["temperature"] != temperature or state["step"] != step or
+            state["maxDepth"] != maxDepth):
+            raise ValueError("Checkpoint %s was saved by another run!" 
+                             % checkpointPath)
+        tree.restore(state["currentSnapshot"])
+        # moves are chosen from the same order of nodes as before
+        tree.restoreOrder(state["nodeOrder"])
+        treeMSE = state["currentMSE"]
+        temp = state["temp"]
+        bestSnapshot = state["bestSnapshot"]
+        bestMSE = state["bestMSE"]
+        bestTreeTemp = state["bestTreeTemp"]
+        theWorstMSE = state["theWorstMSE"]
+        trace = state["trace"]
+        stats = state["stats"]
+        schedule = state["schedule"]
+        steps = state["steps"]
+        stepsSinceImprovement = state["stepsSinceImprovement"]
+        random.setstate(state["randomState"])
+    elif initialTree is None:
+        tree.generate()
+        treeMSE = tree.evaluate()
+    else:
+        # a loaded model is turned into a tree structure
+        if hasattr(initialTree, "toFlatTree"):
+            initialTree = initialTree.toFlatTree()
+        treeMSE = tree.restore(initialTree)
+    
+    # mini-batch scoring: MSE of the current tree on the sample
+    sampleMSE = None
+    def drawSample():
+        return tree.setFitRows(csvloader.sampleRows(
+                        tree.csvData, sampleSize, sampleMethod, 
+                        tree.paramToPredict,
+                        seed=random.randint(0, 2 ** 31 - 1)))
+    if sampleSize is not None:
+        if state is not None and state.get("sampleRows") is not None:
+            # the sample of the checkpoint, not a new one
+            tree.setFitRows(state["sampleRows"])
+            sampleMSE = state["sampleMSE"]
+        else:
+            sampleMSE = drawSample()
+    
+    def checkpoint():
+        saveCheckpoint(checkpointPath, {
+            "paramToPredict": paramToPredict, "temperature": temperature,
+            "step": step, "maxDepth": maxDepth, "temp": temp,
+            "currentSnapshot": tree.snapshot(), "nodeOrder": tree.nodeOrder(),
+            "currentMSE": treeMSE, "sampleRows": tree.fitRows, 
+            "sampleMSE": sampleMSE, "bestSnapshot": bestSnapshot,
+            "bestMSE": bestMSE, "bestTreeTemp": bestTreeTemp,
+            "theWorstMSE": theWorstMSE, "trace": trace, "stats": stats,
+            "schedule": schedule,
+            "steps": steps, "stepsSinceImprovement": stepsSinceImprovement,
+            "randomState": random.getstate()})
     
-    while temp > 0:
-        # get a neighbouring tree
-        newTree = tree.generateNeighbouringTree()
-        newTree.clearAllFittingData()
-        newTree.insertDataCollection(csvData)
-        newTree.computeMeanLeavesValues()
-        newTreeMSE = newTree.getMeanSquaredError()
+    counters = stats.counters
+    stats.mark()
+    while temp > finalTemperature:
+        # random number of the acceptance test, drawn when it's needed
+        x = None
+        passed = True
+        # move to a neighbouring tree in place, it's undone when rejected
+        if proposals > 1:
+            moves = [m for m in (tree.proposeMove() 
+                                 for _ in xrange(proposals)) if m is not None]
+            counters["proposed"] += len(moves)
+            stats.lap("propose")
+            move = None
+            if moves:
+                deltas = tree.scoreMoves(moves) / tree.numFittedRows()
+                x = random.uniform(0,1)
+                move = chooseMove(moves, deltas, temp, x)
+                # no candidate passed, the step is rejected
+                passed = move is not None
+            stats.lap("evaluate")
+        else:
+            move = tree.proposeMove()
+            counters["proposed"] += 1
+            stats.lap("propose")
+        if move is None:
+            if passed:
+                counters["noMove"] += 1
+        elif move.get('maxDepth'):
+            counters["maxDepthHits"] += 1
+        undo = tree.applyMove(move)
+        if (move is not None and move['type'] == "insert" and 
+            (move['node'].left.data.count == 0 or 
+             move['node'].right.data.count == 0)):
+            counters["emptyLeafSplits"] += 1
+        stats.lap("apply")
+        newTreeMSE = tree.getFittedMeanSquaredError()
+        if sampleMSE is not None and passed:
+            # the move is scored on all rows only if it would be accepted
+            # on the sample (with the same random number)
+            newSampleMSE = newTreeMSE
+            sampleDelta = newSampleMSE - sampleMSE
+            if sampleDelta > 0:
+                if x is None:
+                    x = random.uniform(0,1)
+                passed = x < math.exp(-sampleDelta/temp)
+            if passed:
+                newTreeMSE = tree.getFullMeanSquaredError()
+                counters["fullChecks"] += 1
+        stats.lap("evaluate")
 
-        # save the worst result (just for plotting)
-        if treeMSE > theWorstMSE:
-            theWorstMSE = treeMSE
-        if newTreeMSE > theWorstMSE:
-            theWorstMSE = newTreeMSE
-        
-        # check if newTree gives better result than bestTree
-        if newTreeMSE < bestMSE or bestMSE == None:
-            bestTree = copy.deepcopy(newTree)
-            bestMSE = newTreeMSE
-            bestTreeTemp = temp
+        improved = False
+        if passed:
+            # save the worst result (just for plotting)
+            if treeMSE > theWorstMSE:
+                theWorstMSE = treeMSE
+            if newTreeMSE > theWorstMSE:
+                theWorstMSE = newTreeMSE
             
-        delta = (newTreeMSE - treeMSE)
-        if delta <= 0:
-            tree = copy.deepcopy(newTree)
-            treeMSE = newTreeMSE
+            # check if newTree gives better result than bestTree
+            improved = newTreeMSE < bestMSE or bestMSE == None
+            if improved:
+                bestSnapshot = tree.snapshot()
+                bestMSE = newTreeMSE
+                bestTreeTemp = temp
+        if improved:
+            stepsSinceImprovement = 0
         else:
-            x = random.uniform(0,1)
-            if x < math.exp(-delta/temp):
-                worseDecisionMSE.append(newTreeMSE)
-                worseDecisionTemp.append(temp)
-                tree = copy.deepcopy(newTree)
+            stepsSinceImprovement += 1
+        stats.lap("best")
+            
+        accepted = passed
+        if passed:
+            delta = (newTreeMSE - treeMSE)
+            if delta <= 0:
                 treeMSE = newTreeMSE
-        print "Temp: ", temp
+            else:
+                if x is None:
+                    x = random.uniform(0,1)
+                if x < math.exp(-delta/temp):
+                    if trace.enabled:
+                        trace.recordWorseDecision(temp, newTreeMSE)
+                    treeMSE = newTreeMSE
+                    counters["acceptedWorse"] += 1
+                else:
+                    accepted = False
+        if not accepted:
+            tree.undoMove(undo)
+        elif sampleMSE is not None:
+            sampleMSE = newSampleMSE
+        if accepted:
+            counters["accepted"] += 1
+        else:
+            counters["rejected"] += 1
+        stats.lap("accept")
+        if trace.enabled:
+            trace.recordStep(temp, treeMSE)
+        if progress is not None:
+            progress.log(steps, temp, treeMSE, bestMSE)
+        stats.lap("trace")
+        temp = schedule.next(temp, accepted, improved)
+        stats.lap("schedule")
         
-        allMSE.append(treeMSE)
-        allTemp.append(temp)
-        temp = changeTemperature(temp, step)
+        steps += 1
+        stats.steps += 1
+        if (sampleMSE is not None and resampleInterval and 
+            steps % resampleInterval == 0):
+            sampleMSE = drawSample()
+        if checkpointPath and steps % checkpointInterval == 0:
+            checkpoint()
+            stats.lap("checkpoint")
+        if stopwatch.shouldStop(steps, stepsSinceImprovement):
+            break
 
-    result = {"bestTree": bestTree, "allMSE": allMSE, "allTemp":allTemp, 
-              "temperature":temperature, "step":step, "theWorstMSE":theWorstMSE,
-              "bestMSE":bestMSE, "worseDecisionMSE":worseDecisionMSE, 
-              "worseDecisionTemp":worseDecisionTemp, "bestTreeTemp": bestTreeTemp}
+    # no step was made, the initial tree is the best one
+    if bestSnapshot is None:
+        bestSnapshot = tree.snapshot()
+        bestMSE = treeMSE
+        bestTreeTemp = temp
+    
+    if checkpointPath:
+        checkpoint()
+
+    bestTree = newTree(csvData, paramToPredict, weights)
+    bestTree.restore(bestSnapshot)
+
+    result = {"bestTree": bestTree, "temperature":temperature, "step":step, 
+              "theWorstMSE":theWorstMSE, "bestMSE":bestMSE, 
+              "bestTreeTemp": bestTreeTemp, "bestSnapshot": bestSnapshot, 
+              "currentSnapshot": tree.snapshot(), "currentMSE": treeMSE, 
+              "finalTemperature": temp, "steps": steps, "stats": stats,
+              "targetMSE": bestTree.targetMeanSquaredErrors()}
+    result.update(trace.toResult())
     return result
 
-def plotResult(result, xlabel, ylabel, pathToSave=None):
-    allMSE = result["allMSE"]
-    theWorstMSE = result["theWorstMSE"]
-    bestMSE = result['bestMSE']
-    tempRange = result['allTemp']
-    worseDecisionChosenMSE = result['worseDecisionMSE']
-    worseDecisionChosenTemp = result['worseDecisionTemp']
-    
-    # clear last image
-    plt.clf()
-    
-    # plot every result
-    plt.plot(tempRange, allMSE)
-    
-    # plot when the worse decision was chosen
-    plt.scatter(worseDecisionChosenTemp, worseDecisionChosenMSE, s=10, 
-                color='m', marker='s', label="Worse decision is chosen")
-    
-    # plot best result
-    plt.plot([result['bestTreeTemp']], [result['bestMSE']], "ro", 
-             label="Best solution")
-    
-    # set axis length
-    plt.axis([tempRange[0],0, bestMSE - (0.05 * bestMSE), 
-              theWorstMSE + (0.05 * theWorstMSE)])
-    plt.xlabel(xlabel)
-    plt.ylabel(ylabel)   
+def chooseMove(moves, deltas, temp, x):
+    ''' Metropolis rule of several candidate moves. Every candidate is 
+    tested with the same random number x (it passes if 
+    x < exp(-delta / temp)) and one of the passing candidates is drawn with
+    probability proportional to exp(-delta / temp). The best candidate 
+    passes whenever any one does, so a step is accepted with probability 
+    min(1, exp(-min(deltas) / temp)).
+    @param deltas: changes of MSE the moves would make
+    @return chosen move or None if no candidate passes'''
+    passing = np.flatnonzero(x < np.exp(-np.maximum(deltas, 0) / temp))
+    if len(passing) == 0:
+        return None
+    weights = np.cumsum(np.exp(-(deltas[passing] - deltas[passing].min()) 
+                               / temp))
+    chosen = np.searchsorted(weights, random.uniform(0, weights[-1]), 
+                             side='right')
+    return moves[passing[min(chosen, len(passing) - 1)]]
 
-    fontP = FontProperties()
-    fontP.set_size('small')
-    plt.legend(prop = fontP, loc='upper center', bbox_to_anchor=(0.5, 1.05),
-          ncol=3, fancybox=True, shadow=True)
-    
-    if pathToSave == None:
-        plt.show()
-    else:
-        plt.savefig(pathToSave)
+def newTree(csvData, paramToPredict, weights=None):
+    ''' Empty tree predicting a parameter or a list of parameters.'''
+    if isinstance(paramToPredict, basestring):
+        return BinaryTree(csvData, paramToPredict)
+    if len(paramToPredict) == 1:
+        return BinaryTree(csvData, paramToPredict[0])
+    return MultiTargetTree(csvData, paramToPredict, weights)
+
+def saveCheckpoint(path, state):
+    ''' Save a state of annealing. The file is replaced atomically, so a job
+    killed while saving leaves the previous checkpoint.'''
+    tmpPath = path + ".tmp"
+    with open(tmpPath, 'wb') as f:
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmpPath, path)
 
-def changeTemperature(temp, step):
-    temp -= step
-    return temp
+def loadCheckpoint(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def defaultPlotPath(ifile, paramToPredict, temperature, maxDepth, root="img/",
+                    step=1):
+    ''' Path of a plot: img/<dataset>/temp<temperature>/
+    <param>_max_depth_<maxDepth>[_step_<step>].png (the step is there if 
+    it isn't 1). The directory is created if needed.'''
+    if ifile == "cars.csv":
+        csvDir = "cars/"
+    elif ifile == "camera.csv":
+        csvDir = "cameras/"
+    else:
+        csvDir = os.path.splitext(os.path.basename(ifile))[0] + "/"
+    # if the directory does not exist, create it
+    directory = root + csvDir + "temp" + str(temperature) + "/"
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+         
+    suffix = ""
+    if step != 1:
+        suffix = "_step_%g" % step
+    return (directory + paramToPredict + 
+        "_max_depth_" + str(maxDepth) + suffix + ".png")
 
 def usage():
     print("""Usage: %s -i input.csv -o output.png -p paramToPredict 
-        [-t arg] [-s arg ] [-d arg] [-g treeGraph.png]""" % sys.argv[0])
+        [-t arg] [-s arg ] [-d arg] [-g treeGraph.png] [-k arg] [-j arg] 
+        [-x arg] [-b] [-m model.rtree] [-w model.rtree] [-c checkpoint] 
+        [-n arg] [-r] [-S schedule] [-P arg] [-B arg] [-e arg] [-E arg] 
+        [-l trace.npz] [-L arg] [-T] [-R profile.out] [-a arg] [-A method]
+        [-y arg] [-W list] [-C arg] [--no-plot]""" % sys.argv[0])
     print ""
     print "-i: input CSV file"
     print "-o: output graph"
-    print "-p: parameter to predict"
+    print "-p: parameter to predict, or a list of them (a,b,c) predicted by"
+    print "    one tree minimizing their combined MSE"
     print "-t: temperature value (default: 100)"
     print "-s: one step size (default: 1)" 
     print "-d: max tree depth (default: 20)" 
     print "-g: generate tree graph"
+    print "-k: number of parallel annealing chains (default: 1), it can't"
+    print "    be combined with -w, -c, -r, -S, -P, -B, -a, -y, -e, -E, -L and"
+    print "    -R"
+    print "-j: number of worker processes (default: number of CPUs)"
+    print "-x: steps between exchanges of the best tree among chains"
+    print "-b: load input through a binary cache (input.csv.cache/)"
+    print "-m: save the best tree to a model file"
+    print "-w: start from a tree of a model file (warm start)"
+    print "-c: checkpoint file of the annealing state"
+    print "-n: steps between checkpoints (default: 1000)"
+    print "-r: resume from the checkpoint file"
+    print "-S: cooling schedule: linear (default), geometric[:alpha], log[:c],"
+    print "    adaptive[:acceptance rate], reheat[:patience]"
+    print "-P: stop after this many steps without a new best tree"
+    print "-B: stop after this many seconds"
+    print "-e: trace every n-th step (default: 1, 0 turns tracing off)"
+    print "-E: keep only the last n trace records (0 turns tracing off)"
+    print "-l: save the trace to a binary file"
+    print "-L: seconds between progress lines (default: 1, 0 for none)"
+    print "-T: print timers of annealing phases and counters of moves"
+    print "-R: run annealing under cProfile and save its statistics (one chain)"
+    print "-a: score moves on a sample of this many rows first"
+    print "-A: sampling method: uniform (default) or stratified"
+    print "-y: steps after which a new sample is drawn (default: fixed sample)"
+    print "-W: weights of the parameters to predict in the combined MSE"
+    print "    (default: 1 / (number of parameters * variance))"
+    print "-C: candidate moves scored together in every step (default: 1)"
+    print "--no-plot: don't plot the trace (matplotlib isn't loaded)"
     
     print "\nExample:"
     print "$ python annealing.py -i cars.csv -p Weight -t 5 -s 0.01 -d 10 -o plotting.png -g treegraph.png"
@@ -146,10 +392,33 @@ if __name__ == "__main__":
     ifile = ''
     ofile = ''
     paramToPredict = ''
+    weights = None
+    proposals = 1
     temperature = 100
     step = 1
     maxDepth = 20
     treeGraphPath = ''
+    chains = 1
+    processes = None
+    exchangeInterval = None
+    useCache = False
+    modelPath = ''
+    warmStartPath = ''
+    checkpointPath = None
+    checkpointInterval = 1000
+    resume = False
+    scheduleSpec = "linear"
+    stopCriteria = []
+    traceDecimation = 1
+    traceCapacity = None
+    tracePath = ''
+    logInterval = 1.0
+    printStats = False
+    noPlot = False
+    profilePath = None
+    sampleSize = None
+    sampleMethod = "uniform"
+    resampleInterval = None
     
     # i - inputfile
     # o - output plotting
@@ -158,7 +427,32 @@ if __name__ == "__main__":
     # s - step size
     # d - max depth
     # g - output tree graph
-    myopts, args = getopt.getopt(sys.argv[1:], "i:o:p:t:s:d:g:")
+    # k - number of chains
+    # j - number of processes
+    # x - exchange interval
+    # b - binary cache
+    # m - output model
+    # w - warm start model
+    # c - checkpoint file
+    # n - checkpoint interval
+    # r - resume
+    # S - cooling schedule
+    # P - patience (steps without improvement)
+    # B - time budget
+    # e - trace decimation
+    # E - trace capacity
+    # l - trace file
+    # L - log interval
+    # T - print stats
+    # R - cProfile output
+    # a - sample size
+    # A - sampling method
+    # y - resample interval
+    # W - weights of parameters to predict
+    # C - candidate moves per step
+    myopts, args = getopt.getopt(sys.argv[1:], 
+                    "i:o:p:t:s:d:g:k:j:x:bm:w:c:n:rS:P:B:e:E:l:L:TR:a:A:y:W:C:",
+                    ["no-plot"])
     
     minArg = 7
     if len(sys.argv) < minArg:
@@ -180,47 +474,148 @@ if __name__ == "__main__":
             maxDepth = int(arg)
         elif option == '-g':
             treeGraphPath = arg   
+        elif option == '-k':
+            chains = int(arg)
+        elif option == '-j':
+            processes = int(arg)
+        elif option == '-x':
+            exchangeInterval = int(arg)
+        elif option == '-b':
+            useCache = True
+        elif option == '-m':
+            modelPath = arg
+        elif option == '-w':
+            warmStartPath = arg
+        elif option == '-c':
+            checkpointPath = arg
+        elif option == '-n':
+            checkpointInterval = int(arg)
+        elif option == '-r':
+            resume = True
+        elif option == '-S':
+            scheduleSpec = arg
+        elif option == '-P':
+            stopCriteria.append(schedules.NoImprovementStop(int(arg)))
+        elif option == '-B':
+            stopCriteria.append(schedules.TimeBudgetStop(float(arg)))
+        elif option == '-e':
+            traceDecimation = int(arg)
+        elif option == '-E':
+            traceCapacity = int(arg)
+        elif option == '-l':
+            tracePath = arg
+        elif option == '-L':
+            logInterval = float(arg) or None
+        elif option == '-T':
+            printStats = True
+        elif option == '-R':
+            profilePath = arg
+        elif option == '-a':
+            sampleSize = int(arg)
+        elif option == '-A':
+            sampleMethod = arg
+        elif option == '-y':
+            resampleInterval = int(arg)
+        elif option == '-W':
+            weights = [float(w) for w in arg.split(",")]
+        elif option == '-C':
+            proposals = int(arg)
+        elif option == '--no-plot':
+            noPlot = True
         else:
             usage()
+    
+    # options of a single chain, parallel chains don't support them
+    singleChainOptions = ['-w', '-c', '-r', '-S', '-P', '-B', '-a', '-y', 
+                          '-e', '-E', '-L', '-R']
+    ignored = [option for option, arg in myopts 
+               if option in singleChainOptions]
+    if chains > 1 and ignored:
+        print "Options %s can't be used with -k" % ", ".join(ignored)
+        usage()
+        sys.exit(2)
                          
     print ("""Input csv :  %s\nparam: %s\ntemp: %d\nstep: %f\nmaxDepth: %d""" 
            % (ifile, paramToPredict, temperature, step, maxDepth))
      
-    # load csv_file (camera.csv or cars.csv only)
-    if ifile == "cars.csv":
-        csvData = csvloader.loadCars(ifile)
-        csvDir = "cars/"
+    # load csv_file (types of columns and delimiter are detected)
+    if useCache:
+        csvData = csvloader.loadCached(ifile)
     else:
-        csvData = csvloader.loadCameras(ifile)
-        csvDir = "cameras/"
+        csvData = csvloader.load(ifile)
+    
+    # several parameters (a,b,c) are predicted by one tree
+    targets = paramToPredict
+    if "," in paramToPredict:
+        targets = paramToPredict.split(",")
  
-    result = simulatedAnnealing(csvData, paramToPredict, temperature=temperature, 
-                                    maxDepth=maxDepth, step=step)
+    if chains > 1:
+        import parallel
+        result = parallel.parallelAnnealing(csvData, targets, 
+                                    temperature=temperature, maxDepth=maxDepth,
+                                    step=step, chains=chains, 
+                                    processes=processes,
+                                    exchangeInterval=exchangeInterval,
+                                    weights=weights, proposals=proposals)
+    else:
+        initialTree = None
+        if len(warmStartPath) != 0:
+            initialTree = modelfile.loadModel(warmStartPath)
+        options = dict(temperature=temperature, maxDepth=maxDepth, step=step,
+                       initialTree=initialTree, checkpointPath=checkpointPath,
+                       checkpointInterval=checkpointInterval, resume=resume,
+                       schedule=schedules.parseSchedule(scheduleSpec, 
+                                                        temperature, step),
+                       stopCriteria=stopCriteria,
+                       trace=tracing.Trace(traceDecimation, traceCapacity,
+                                           ring=True),
+                       logInterval=logInterval, sampleSize=sampleSize,
+                       sampleMethod=sampleMethod, 
+                       resampleInterval=resampleInterval, weights=weights,
+                       proposals=proposals)
+        if profilePath is None:
+            result = simulatedAnnealing(csvData, targets, **options)
+        else:
+            result = profiling.runProfiled(simulatedAnnealing, 
+                                           (csvData, targets), options,
+                                           path=profilePath)
+            print "Profile saved in: ", profilePath
      
     print "Result for: ", paramToPredict, " and csv: ", ifile
     print "Solution (best MSE): ", result['bestMSE']
     print "found, when temperature was: ", result['bestTreeTemp']
+    if not isinstance(targets, basestring):
+        for param in targets:
+            print "MSE of %s: %f" % (param, result['targetMSE'][param])
+    if printStats:
+        print result['stats'].summary()
           
-    if len(ofile) == 0:
-        # if the directory does not exist, create it
-        directory = "img/" + csvDir + "temp" + str(temperature) + "/"
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-             
-        path = (directory + paramToPredict + 
-            "_max_depth_" + str(maxDepth) + ".png")
-          
+    if len(tracePath) != 0:
+        tracing.saveTrace(tracePath, result)
+        print "Trace saved in: ", tracePath
+    
+    if noPlot:
+        pass
+    elif len(result['allMSE']) == 0:
+        print "No trace was recorded, nothing to plot"
     else:
-        path = ofile
-    plotResult(result, "Temperature", paramToPredict + " Mean Squared Error",
-                         pathToSave=path)
-    print "Function plotting saved in: ", path
+        if len(ofile) == 0:
+            path = defaultPlotPath(ifile, paramToPredict, temperature, maxDepth,
+                                   step=step)
+        else:
+            path = ofile
+        plotResult(result, "Temperature", paramToPredict + " Mean Squared Error",
+                             pathToSave=path)
+        print "Function plotting saved in: ", path
      
     # save output graph
     if len(treeGraphPath) != 0:
         bestTree = result['bestTree']
         bestTree.printTree(treeGraphPath)            
         print "Graph saved in: ", treeGraphPath
-
-
-
+     
+    # save the best tree without training data
+    if len(modelPath) != 0:
+        modelfile.saveModel(modelPath, result['bestTree'], 
+                            {"bestMSE": result['bestMSE'], "input": ifile})
+        print "Model saved in: ", modelPath
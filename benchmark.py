@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+''' Benchmarks of tree fitting, evaluation, prediction and annealing on the
+csv datasets and on synthetic datasets of any size. Every case runs in a
+fresh worker process, so its peak memory is its own. Results are written as
+JSON lines and can be compared with results of an earlier run.'''
+
+import csvloader
+from annealing import simulatedAnnealing
+from binarytree import BinaryTree
+from dataset import Dataset
+from featureindex import FeatureIndex
+import tracing
+
+import getopt
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+defaultDatasets = [("cars.csv", "Weight"), ("camera.csv", "Price")]
+defaultSynthetic = [(100000, 10), (1000000, 10), (100000, 100)]
+defaultMaxDepths = [10, 20]
+# modules whose import time is measured; rendering backends (matplotlib, 
+# pydot) must not be loaded by any of them
+startupModules = ["binarytree", "annealing", "csvloader", "predictor"]
+heavyModules = ["matplotlib", "pydot"]
+
+def makeSyntheticDataset(rows, columns, seed=0):
+    ''' Dataset of uniform float features f0..f<columns-1> and a target y
+    which is a step function of a few features with noise, so trees have
+    something to find.'''
+    generator = np.random.RandomState(seed)
+    data = {}
+    for i in xrange(columns):
+        data["f%d" % i] = generator.rand(rows)
+    y = generator.normal(0, 0.1, rows)
+    for i in xrange(min(columns, 5)):
+        y += (data["f%d" % i] < 0.5) * (i + 1)
+    data["y"] = y
+    return Dataset(data, ["f%d" % i for i in xrange(columns)] + ["y"])
+
+def makeCases(datasets, synthetic, maxDepths, iterations=2000):
+    ''' List of benchmark cases for every dataset and max depth.
+    @param datasets: list of (csv file, parameter to predict)
+    @param synthetic: list of (rows, columns) of synthetic datasets'''
+    cases = []
+    for maxDepth in maxDepths:
+        for ifile, param in datasets:
+            cases.append({"input": ifile, "param": param,
+                          "maxDepth": maxDepth, "iterations": iterations})
+        for rows, columns in synthetic:
+            cases.append({"input": "synthetic", "rows": rows,
+                          "columns": columns, "param": "y",
+                          "maxDepth": maxDepth, "iterations": iterations})
+    return cases
+
+def timed(func, *args):
+    ''' @return (result of func, seconds it took)'''
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+def runCase(case, insertRows=100000, predictRows=1000, seed=0):
+    ''' Run one benchmark case.
+    @param insertRows: maximum number of rows fitted by the per-row
+    insertDataCollection (it's too slow for the largest datasets)
+    @return record of the case with measured rates'''
+    record = dict(case)
+    random.seed(seed)
+    if case["input"] == "synthetic":
+        csvData, seconds = timed(makeSyntheticDataset, case["rows"],
+                                 case["columns"], seed)
+    else:
+        csvData, seconds = timed(csvloader.load, case["input"])
+    record["loadSeconds"] = seconds
+    record["rows"] = len(csvData)
+    # features, without the parameter to predict
+    record["columns"] = len(csvData.parameters) - 1
+
+    index, seconds = timed(FeatureIndex.get, csvData, BinaryTree.quantileBins)
+    record["indexSeconds"] = seconds
+
+    BinaryTree.maxDepth = case["maxDepth"]
+    tree = BinaryTree(csvData, case["param"])
+    tree.generate()
+    record["treeSize"] = tree.size(tree.root)
+
+    n = min(len(csvData), insertRows)
+    tree.clearAllFittingData()
+    _, seconds = timed(tree.insertDataCollection, xrange(n))
+    record["insertRowsPerSecond"] = n / seconds
+
+    _, seconds = timed(tree.evaluate)
+    record["evaluateRowsPerSecond"] = len(csvData) / seconds
+    _, seconds = timed(tree.getMeanSquaredError)
+    record["mseRowsPerSecond"] = len(csvData) / seconds
+
+    rows = [csvData.row(i) for i in xrange(min(len(csvData), predictRows))]
+    start = time.time()
+    for row in rows:
+        tree.predictValue(row, case["param"], tree.root)
+    record["predictValueLatency"] = (time.time() - start) / len(rows)
+    predictor = tree.toPredictor()
+    predictor.predictRow(rows[0])
+    start = time.time()
+    for row in rows:
+        predictor.predictRow(row)
+    record["predictRowLatency"] = (time.time() - start) / len(rows)
+    _, seconds = timed(predictor.predict, csvData)
+    record["predictRowsPerSecond"] = len(csvData) / seconds
+
+    iterations = case["iterations"]
+    result, seconds = timed(lambda: simulatedAnnealing(
+                                csvData, case["param"],
+                                temperature=iterations,
+                                maxDepth=case["maxDepth"], seed=seed,
+                                trace=tracing.Trace(0), logInterval=None))
+    record["annealingIterationsPerSecond"] = result["steps"] / seconds
+
+    # kilobytes on Linux
+    record["peakMemoryMB"] = resource.getrusage(
+                                resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return record
+
+startupScript = """
+import sys, time
+start = time.time()
+import %s
+seconds = time.time() - start
+print seconds, len(sys.modules), ",".join(m for m in %r if m in sys.modules)
+"""
+
+def measureStartup(module, repeat=5):
+    ''' Import a module in fresh interpreters.
+    @return record with the best import time, the number of modules loaded
+    by the import and the rendering backends it loaded'''
+    times = []
+    for _ in xrange(repeat):
+        output = subprocess.check_output([sys.executable, "-c",
+                                          startupScript % (module, 
+                                                           heavyModules)])
+        fields = output.split()
+        times.append(float(fields[0]))
+    return {"input": "startup", "module": module, "importSeconds": min(times),
+            "loadedModules": int(fields[1]),
+            "backends": fields[2].split(",") if len(fields) > 2 else []}
+
+def caseKey(record):
+    if record["input"] == "startup":
+        return (record["input"], record["module"])
+    return (record["input"], record["param"], record["rows"],
+            record["columns"], record["maxDepth"])
+
+def caseName(record):
+    if record["input"] == "startup":
+        return "import %s" % record["module"]
+    if record["input"] == "synthetic":
+        return ("synthetic %dx%d d=%d" % (record["rows"], record["columns"],
+                                          record["maxDepth"]))
+    return "%s d=%d" % (record["input"], record["maxDepth"])
+
+metrics = ["insertRowsPerSecond", "evaluateRowsPerSecond", "mseRowsPerSecond",
+           "predictRowsPerSecond", "annealingIterationsPerSecond"]
+
+def runBenchmark(cases, resultsPath="benchmark.jsonl", 
+                 modules=startupModules):
+    ''' Measure import times of modules, then run cases one by one, each in
+    a new worker process, and write their records as JSON lines.
+    @return list of records'''
+    environment = {"python": platform.python_version(),
+                   "numpy": np.__version__, "machine": platform.machine(),
+                   "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    records = []
+    startup = []
+    for module in modules:
+        record = measureStartup(module)
+        record.update(environment)
+        startup.append(record)
+        print ("%s: %.1f ms, %d modules%s" 
+               % (caseName(record), 1e3 * record["importSeconds"],
+                  record["loadedModules"],
+                  "".join(", loads " + m for m in record["backends"])))
+    # one process per case, so every case starts with a clean heap
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        with open(resultsPath, 'w') as f:
+            for record in startup:
+                f.write(json.dumps(record, sort_keys=True) + "\n")
+                records.append(record)
+            for record in pool.imap(runCase, cases):
+                record.update(environment)
+                f.write(json.dumps(record, sort_keys=True) + "\n")
+                f.flush()
+                records.append(record)
+                print ("%s: %.0f iterations/s, evaluate %.0f rows/s, "
+                       "predictValue %.1f us, %.0f MB"
+                       % (caseName(record),
+                          record["annealingIterationsPerSecond"],
+                          record["evaluateRowsPerSecond"],
+                          1e6 * record["predictValueLatency"],
+                          record["peakMemoryMB"]))
+    finally:
+        pool.close()
+        pool.join()
+    return records
+
+def loadResults(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def compareResults(baseline, records):
+    ''' Print speedups of records over baseline records of the same cases.'''
+    base = dict((caseKey(record), record) for record in baseline)
+    for record in records:
+        old = base.get(caseKey(record))
+        if old is None:
+            continue
+        if record["input"] == "startup":
+            print "%s: x%.2f" % (caseName(record), old["importSeconds"] / 
+                                 record["importSeconds"])
+            continue
+        speedups = ["%s x%.2f" % (metric.replace("PerSecond", ""),
+                                  record[metric] / old[metric])
+                    for metric in metrics if old.get(metric)]
+        print "%s: %s" % (caseName(record), ", ".join(speedups))
+
+def parseSizes(arg):
+    ''' "100000x10,1000000x100" -> [(100000, 10), (1000000, 100)]'''
+    sizes = []
+    for size in arg.split(","):
+        rows, columns = size.split("x")
+        sizes.append((int(float(rows)), int(columns)))
+    return sizes
+
+def usage():
+    print("""Usage: %s [-o benchmark.jsonl] [-d list] [-n arg] [-r list]
+        [-c baseline.jsonl] [-q] [-u] [input.csv:param ...]""" % sys.argv[0])
+    print ""
+    print "-o: results file, JSON lines (default: benchmark.jsonl)"
+    print "-d: max tree depths (default: 10,20)"
+    print "-n: annealing iterations per case (default: 2000)"
+    print "-r: synthetic datasets, rows x columns "
+    print "    (default: 1e5x10,1e6x10,1e5x100)"
+    print "-c: compare results with an earlier results file"
+    print "-q: only csv datasets, no synthetic ones"
+    print "-u: only import times of modules (startup)"
+    print "Without inputs cars.csv (Weight) and camera.csv (Price) are used."
+
+    print "\nExample:"
+    print "$ python benchmark.py -d 10 -r 1e5x10,1e7x10,1e5x500 -c old.jsonl"
+
+if __name__ == "__main__":
+    resultsPath = "benchmark.jsonl"
+    maxDepths = defaultMaxDepths
+    iterations = 2000
+    synthetic = defaultSynthetic
+    baselinePath = None
+    startupOnly = False
+
+    try:
+        myopts, args = getopt.getopt(sys.argv[1:], "o:d:n:r:c:quh")
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for option, arg in myopts:
+        if option == '-o':
+            resultsPath = arg
+        elif option == '-d':
+            maxDepths = [int(d) for d in arg.split(",")]
+        elif option == '-n':
+            iterations = int(arg)
+        elif option == '-r':
+            synthetic = parseSizes(arg)
+        elif option == '-c':
+            baselinePath = arg
+        elif option == '-q':
+            synthetic = []
+        elif option == '-u':
+            startupOnly = True
+        else:
+            usage()
+            sys.exit(0)
+
+    datasets = defaultDatasets
+    if args:
+        datasets = [tuple(arg.split(":")) for arg in args]
+
+    # the baseline is read first, it may be the results file itself
+    baseline = None
+    if baselinePath is not None:
+        baseline = loadResults(baselinePath)
+    cases = []
+    if not startupOnly:
+        cases = makeCases(datasets, synthetic, maxDepths, iterations)
+    records = runBenchmark(cases, resultsPath)
+    print "Results saved in: ", resultsPath
+    if baseline is not None:
+        compareResults(baseline, records)
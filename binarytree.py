@@ -3,114 +3,362 @@
 
 import random
 import copy
-import pydot
 from itertools import count
-import math
+import numpy as np
 
-class NodeData:
+from dataset import Dataset
+from flattree import FlatTree
+from featureindex import FeatureIndex
+from indexedset import IndexedSet
+from predictor import Predictor
+import plotting
+
+def segmentSums(values, counts):
+    ''' Sums of consecutive segments of values (one per count, segments may
+    be empty) with one reduction.
+    @param values: array of rows (2-D: one sum per column)'''
+    sums = np.zeros((len(counts),) + values.shape[1:])
+    nonEmpty = counts > 0
+    starts = (np.cumsum(counts) - counts)[nonEmpty]
+    if len(starts) > 0:
+        sums[nonEmpty] = np.add.reduceat(values, starts)
+    return sums
+
+class NodeData(object):
     ''' Data connected with every node'''
-    param = None
-    value = 0
+    __slots__ = ('param', 'value', 'fittingData', 'meanData', 'count', 'sum',
+                 'sumSquares')
     
-    def __init__(self, parameters=None, minMaxParamValues=None):
-        ''' @param minMaxParamValues: dictionary of minValue and maxValue of
-        every parameter'''
+    def __init__(self, param=None, value=0):
+        ''' @param param: parameter of a split (None for a leaf)
+        @param value: value of a split'''
         
-        self.ranges = copy.deepcopy(minMaxParamValues)
-        # list of data which fits to current leaf
-        self.fittingData = []
+        self.param = param
+        self.value = value
+        # array of row indices of data which fits to current leaf
+        self.fittingData = np.zeros(0, dtype=np.intp)
         # computed mean values of each parameter (only when node is a leaf)
         self.meanData = {}
+        # statistics of the parameter to predict over fittingData
+        self.count = 0
+        self.sum = 0.0
+        self.sumSquares = 0.0
   
-class Node:
+class Node(object):
     ''' Node of a tree.'''  
-    idCounter = count(0)
+    __slots__ = ('left', 'right', 'parent', 'data', 'isLeaf', 'id', 'depth')
 
-    def __init__(self):
+    def __init__(self, nodeId=0, parent=None):
         self.left = None
         self.right = None
-        self.parent = None
+        self.parent = parent
         self.data = NodeData()
         self.isLeaf = True
-        self.id = self.idCounter.next()
+        self.id = nodeId
+        # depth of the node (the root has 0)
+        self.depth = 0 if parent is None else parent.depth + 1
 
 class BinaryTree:
     ''' A binary tree.'''
     # maximal depth of a tree
     maxDepth = 30
+    # how split values are proposed: "uniform" (any value within a range), 
+    # "distinct" (values found in data) or "quantile" (quantile bin edges)
+    splitValues = "distinct"
+    # number of quantile bins of the feature index
+    quantileBins = 256
+    # how many times a leaf to split is drawn again if it has less than two
+    # fitted rows
+    leafDraws = 8
     
     def __init__(self, csvData, parameterToPredict):
-        ''' Constructs empty binary tree. '''
-        self.root = Node()
-        self.root.parent = None
-        self.leaves = [self.root]
+        ''' Constructs empty binary tree.
+        @param csvData: Dataset (a list of dictionaries is converted) '''
+        # ids of nodes are unique within a tree
+        self.idCounter = count(0)
+        self.root = self.newNode()
+        self.resetIndexes()
         self.paramToPredict = parameterToPredict
         
+        if not isinstance(csvData, Dataset):
+            csvData = Dataset.fromRows(csvData)
+        # rows without a value to predict can't be fitted
+        csvData = csvData.withoutMissing(parameterToPredict)
         # A list of available parameters from the datasource
-        self.parameters = csvData[0].keys()
+        self.parameters = csvData.parameters
         self.csvData = csvData
+        # parameters which can be used for a split: numeric ones without 
+        # the parameter to predict (types are detected once by the Dataset)
+        self.splitParameters = [p for p in self.parameters 
+                                if not csvData.isString(p) and 
+                                p != parameterToPredict]
         
         # Get min and max values of each parameter
         self.minMaxParamValues = self.getMinMaxParameterValue(self.csvData)
+        # presorted values of each parameter, shared by trees of the dataset
+        self.featureIndex = FeatureIndex.get(self.csvData, self.quantileBins)
         
+        # sum of squared errors of fitted data, None until evaluate() is called
+        self.sse = None
+        # rows the tree is fitted to (None: all rows), see setFitRows
+        self.fitRows = None
+        # SSE on all rows while fitted to fitRows and (rows, SSE) of all 
+        # rows in every leaf; the change made by the last move (pendingMove)
+        # is computed when it's asked for
+        self.fullSSE = None
+        self.fullRows = {}
+        self.pendingMove = None
+        
+    def newNode(self, parent=None):
+        return Node(self.idCounter.next(), parent)
+
+    def resetIndexes(self):
+        ''' Indexes of a tree which is just the root: leaves, nodes which can
+        be removed (both sons are leaves) and numbers of leaves at every 
+        depth, which give the depth of the tree. Moves keep them up to 
+        date.'''
+        self.leaves = IndexedSet([self.root])
+        self.prunable = IndexedSet()
+        self.leafDepthCounts = [1]
+        self.treeDepth = 0
+
+    def addLeaf(self, node):
+        self.leaves.add(node)
+        counts = self.leafDepthCounts
+        while len(counts) <= node.depth:
+            counts.append(0)
+        counts[node.depth] += 1
+        if node.depth > self.treeDepth:
+            self.treeDepth = node.depth
+
+    def removeLeaf(self, node):
+        self.leaves.remove(node)
+        counts = self.leafDepthCounts
+        counts[node.depth] -= 1
+        while self.treeDepth > 0 and counts[self.treeDepth] == 0:
+            self.treeDepth -= 1
+
+    def updatePrunable(self, node):
+        ''' Add a node to prunable nodes if both its sons are leaves, remove 
+        it otherwise.'''
+        if node is None:
+            return
+        if not node.isLeaf and node.left.isLeaf and node.right.isLeaf:
+            self.prunable.add(node)
+        else:
+            self.prunable.discard(node)
+
+    def attachSons(self, node, sons):
+        ''' Turn a leaf into an inner node with given (leaf) sons.'''
+        node.left, node.right = sons
+        node.isLeaf = False
+        self.removeLeaf(node)
+        self.addLeaf(node.left)
+        self.addLeaf(node.right)
+        self.updatePrunable(node)
+        self.updatePrunable(node.parent)
+
+    def detachSons(self, node):
+        ''' Turn a node whose sons are leaves into a leaf.
+        @return the removed sons'''
+        sons = (node.left, node.right)
+        self.removeLeaf(node.left)
+        self.removeLeaf(node.right)
+        node.left = None
+        node.right = None
+        node.isLeaf = True
+        self.addLeaf(node)
+        self.updatePrunable(node)
+        self.updatePrunable(node.parent)
+        return sons
+
     def generate(self):
         ''' Generating random tree of depht = maxSize / 2.'''
-        while self.getTreeDepth(self.root) != self.maxDepth / 2:
+        while self.treeDepth != self.maxDepth / 2:
             self.insertRandom()
             
     def generateNeighbouringTree(self):
-        newTree = copy.deepcopy(self)
+        ''' Copy of the tree with one random move applied. The dataset and
+        its feature index are shared with the copy.'''
+        newTree = copy.deepcopy(self, {id(self.csvData): self.csvData,
+                                       id(self.featureIndex): 
+                                       self.featureIndex})
+        newTree.applyMove(newTree.proposeMove())
+        return newTree
+    
+    def proposeMove(self):
+        ''' Choose a random move (insert or delete) without changing the tree.
+        @return move record for applyMove or None if nothing can be changed'''
         choice = random.choice(["insert", "delete"])
         
-        if self.getTreeDepth(self.root) == self.maxDepth:
-            newTree.removeRandom()
-            return newTree
+        if self.treeDepth >= self.maxDepth:
+            move = self.proposeRemove()
+            if move is not None:
+                move['maxDepth'] = True
+            return move
         
         if choice == "insert":
-            newTree.insertRandom()
+            return self.proposeInsert()
         elif choice == "delete":
-            newTree.removeRandom()
+            return self.proposeRemove()
         else:
             raise ValueError
-        return newTree
-    
+
+    def applyMove(self, move):
+        ''' Apply a move in place.
+        @return undo record for undoMove'''
+        if move is None:
+            return None
+        if self.fullSSE is not None:
+            self.settleFullError()
+        if move['type'] == "insert":
+            undo = self.applyInsert(move)
+        else:
+            undo = self.applyRemove(move)
+        if self.fullSSE is not None:
+            undo['fullSSE'] = self.fullSSE
+            self.pendingMove = undo
+        return undo
+
+    def undoMove(self, undo):
+        ''' Revert a move applied with applyMove.'''
+        if undo is None:
+            return
+        if 'fullRows' in undo:
+            self.undoFullRows(undo)
+        node = undo['node']
+        if undo['type'] == "insert":
+            # turn the split node back into a leaf
+            self.detachSons(node)
+            node.data = undo['data']
+        else:
+            # bring back the removed sons
+            node.data = undo['data']
+            self.attachSons(node, undo['sons'])
+        self.sse = undo['sse']
+        if 'fullSSE' in undo:
+            self.fullSSE = undo['fullSSE']
+            self.pendingMove = None
+
+    def scoreMoves(self, moves):
+        ''' Change of SSE of the fitted data which every move would make, 
+        without changing the tree. Removals are scored from statistics of 
+        the two leaves. Rows of all split leaves are concatenated, compared
+        with the split values once per split parameter and reduced per 
+        move, so scoring many moves costs little more than scoring one.
+        @param moves: moves of proposeMove (not None)
+        @return array of SSE changes'''
+        deltas = np.zeros(len(moves))
+        inserts = [i for i, move in enumerate(moves) 
+                   if move['type'] == "insert"]
+        removes = [i for i, move in enumerate(moves) 
+                   if move['type'] != "insert"]
+        
+        if removes:
+            sons = [(moves[i]['node'].left.data, moves[i]['node'].right.data)
+                    for i in removes]
+            left = self.stackStatistics([l for l, r in sons])
+            right = self.stackStatistics([r for l, r in sons])
+            merged = [a + b for a, b in zip(left, right)]
+            deltas[removes] = (self.groupErrors(*merged) - 
+                               self.groupErrors(*left) - 
+                               self.groupErrors(*right))
+        
+        if inserts:
+            # grouped by split parameter, so rows of every parameter are 
+            # one slice of the concatenated rows
+            inserts.sort(key=lambda i: moves[i]['data'].param)
+            leaves = [moves[i]['node'].data for i in inserts]
+            rowLists = [np.asarray(data.fittingData, dtype=np.intp) 
+                        for data in leaves]
+            counts = np.array([len(rows) for rows in rowLists], 
+                              dtype=np.intp)
+            rows = np.concatenate(rowLists)
+            ends = np.cumsum(counts)
+            featureValues = np.empty(len(rows))
+            start = 0
+            for j, i in enumerate(inserts):
+                param = moves[i]['data'].param
+                if (j + 1 == len(inserts) or 
+                    moves[inserts[j + 1]]['data'].param != param):
+                    featureValues[start:ends[j]] = self.csvData[param][
+                                                    rows[start:ends[j]]]
+                    start = ends[j]
+            thresholds = np.repeat(
+                            np.array([moves[i]['data'].value 
+                                      for i in inserts], dtype=np.float64),
+                            counts)
+            mask = featureValues < thresholds
+            
+            # statistics of right sons are the rest of the leaf's ones
+            values = self.targetValues(rows)
+            leftValues = values * mask.reshape((-1,) + 
+                                               (1,) * (values.ndim - 1))
+            left = (segmentSums(mask.astype(np.intp), counts),
+                    segmentSums(leftValues, counts),
+                    segmentSums(leftValues * leftValues, counts))
+            total = self.stackStatistics(leaves)
+            right = [a - b for a, b in zip(total, left)]
+            deltas[inserts] = (self.groupErrors(*left) + 
+                               self.groupErrors(*right) - 
+                               self.groupErrors(*total))
+        return deltas
+
+    def stackStatistics(self, leaves):
+        ''' @return arrays (counts, sums, sumSquares) of NodeData'''
+        return (np.array([data.count for data in leaves], dtype=np.intp),
+                np.array([data.sum for data in leaves]),
+                np.array([data.sumSquares for data in leaves]))
 
     def insertRandom(self):
         ''' Inserts random node choosing random parameter with a random range'''
-        # leaf chosen to turn into a node
-        xNode = self.leaves[random.randint(0, len(self.leaves) - 1)]
-        
-        xNodeData = NodeData(parameters=self.parameters, 
-                             minMaxParamValues=self.minMaxParamValues)
-        # copying ranges list from the parent if it's not root
-        if xNode.parent:
-            xNodeData.ranges = copy.deepcopy(xNode.parent.data.ranges)
-            xNode.data = xNodeData
-            # ranges list is updated basing on the parent parameter value
-            self.updateRanges(xNode)
-        else:
-            xNode.data = xNodeData
+        return self.applyMove(self.proposeInsert())
+
+    def proposeInsert(self):
+        ''' Choose a leaf to split and a random parameter with a random value.
+        '''
+        # leaf chosen to turn into a node, one with rows to split is 
+        # preferred
+        xNode = self.leaves.choice()
+        if self.sse is not None:
+            for attempt in xrange(self.leafDraws):
+                if xNode.data.count > 1:
+                    break
+                xNode = self.leaves.choice()
         
         # parameter chosen to be changed
         randParam = self.chooseRandomParameter(self.parameters)            
         # value of the chosen parameter
         randValue = self.chooseRandomValue(xNode, randParam)
+        if randValue is None:
+            # no value of the parameter splits the leaf, try the other ones
+            params = list(self.splitParameters)
+            random.shuffle(params)
+            for param in params:
+                randValue = self.chooseRandomValue(xNode, param)
+                if randValue is not None:
+                    randParam = param
+                    break
+            else:
+                randValue = self.chooseUniformValue(xNode, randParam)
         
         # filling node data for a new node
-        xNodeData.param = randParam
-        xNodeData.value = randValue
-
-        # creating new leaves
-        xNode.left = Node()
-        xNode.right = Node()
-        xNode.left.parent = xNode
-        xNode.right.parent = xNode
-        self.leaves.append(xNode.left)
-        self.leaves.append(xNode.right)
-        # xNode is not a leaf anymore
-        self.leaves.remove(xNode)
-        xNode.isLeaf = False
+        xNodeData = NodeData(randParam, randValue)
+        return {'type': "insert", 'node': xNode, 'data': xNodeData}
+
+    def applyInsert(self, move):
+        xNode = move['node']
+        undo = {'type': "insert", 'node': xNode, 'data': xNode.data, 
+                'sse': self.sse}
+        xNode.data = move['data']
+
+        # creating new leaves, xNode is not a leaf anymore
+        self.attachSons(xNode, (self.newNode(xNode), self.newNode(xNode)))
         
+        # only the split leaf has to be fitted again
+        if self.sse is not None:
+            self.splitLeafData(xNode, undo['data'])
+        return undo
         
     def chooseRandomParameter(self, parameters):
         ''' Choose a random parameter out of all available parameters without 
@@ -118,28 +366,44 @@ class BinaryTree:
         string (because we want to generate a regression tree, not a 
         classification tree). '''
 
-        randParam = random.choice(self.parameters)
-        # a chosen parameter can't be a string
-        while (self.isParameterValue(randParam, basestring) or 
-               randParam == self.paramToPredict):   
-            randParam = random.choice(self.parameters)
-        return randParam
+        return random.choice(self.splitParameters)
     
     def chooseRandomValue(self, node, parameter):
+        ''' Choose a random split value for a given parameter. Depending on 
+        splitValues it's one of the values found in the data (or a quantile 
+        bin edge) or any value within the range of the node. Values are 
+        taken from rows fitted into a leaf (so both sons get some of them),
+        or from the range of the node if the tree isn't fitted.
+        @return None if no value found in the data splits the rows'''
+        if self.splitValues == "uniform":
+            return self.chooseUniformValue(node, parameter)
+        quantile = (self.splitValues == "quantile")
+        if self.sse is not None and node.isLeaf:
+            rows = np.asarray(node.data.fittingData, dtype=np.intp)
+            candidates = self.featureIndex.rowCandidates(
+                                parameter, self.csvData[parameter][rows], 
+                                quantile=quantile)
+        else:
+            minValue, maxValue = self.getParameterRange(node, parameter)
+            candidates = self.featureIndex.candidates(
+                                parameter, minValue, maxValue, 
+                                quantile=quantile)
+        if len(candidates) == 0:
+            return None
+        return candidates[random.randint(0, len(candidates) - 1)].item()
+
+    def chooseUniformValue(self, node, parameter):
         ''' Choose a random value for a given parameter. If parameter value is
         a floating point number, will generate also a floating point number. If 
         parameter value is an integer, will generate an integer.'''
+        minValue, maxValue = self.getParameterRange(node, parameter)
         # if parameter value is float
         if self.isParameterValue(parameter, float):
-            randValue = random.uniform(
-                                   node.data.ranges[parameter]['minValue'], 
-                                   node.data.ranges[parameter]['maxValue'])        
+            randValue = random.uniform(minValue, maxValue)        
             
         # if parameter value is an integer
         elif self.isParameterValue(parameter, int):
-            randValue = random.randint(
-                                   node.data.ranges[parameter]['minValue'], 
-                                   node.data.ranges[parameter]['maxValue'])
+            randValue = random.randint(minValue, maxValue)
         else:
             raise ValueError('''Can't choose random parameter value for variable
                              which is not an integer or float!''')
@@ -147,186 +411,627 @@ class BinaryTree:
     
     def isParameterValue(self, parameter, typeToCompare):
         ''' Check if parameter value is the same type like typeToCompare.'''
-        return isinstance(self.csvData[0][parameter], typeToCompare)
+        return issubclass(self.csvData.pythonType(parameter), typeToCompare)
 
-    def updateRanges(self, node):
-        ''' Updates ranges list of a node basing on its parent 
-        @param node must not be None! '''
-        
+    def getParameterRange(self, node, parameter):
+        ''' Get minValue and maxValue of a parameter in a node. The range of
+        the whole dataset is narrowed by the closest ancestors splitting on 
+        the parameter, so nodes don't have to keep ranges of all parameters.
+        @return (minValue, maxValue)'''
+        minValue = None
+        maxValue = None
+        child = node
         parentNode = node.parent
-        parentValue = parentNode.data.value
-        parentParam = parentNode.data.param
-        ranges = node.data.ranges
+        while parentNode is not None and (minValue is None or 
+                                          maxValue is None):
+            if parentNode.data.param == parameter:
+                # check if node is in the left or right subtree
+                if child is parentNode.left:
+                    if maxValue is None:
+                        maxValue = parentNode.data.value
+                elif minValue is None:
+                    minValue = parentNode.data.value
+            child = parentNode
+            parentNode = parentNode.parent
         
-        # check if node is left or right son
-        if node == parentNode.left:
-            ranges[parentParam]['maxValue'] = parentValue
-        else:
-            ranges[parentParam]['minValue'] = parentValue
+        if minValue is None:
+            minValue = self.minMaxParamValues[parameter]['minValue']
+        if maxValue is None:
+            maxValue = self.minMaxParamValues[parameter]['maxValue']
+        return minValue, maxValue
        
     def removeRandom(self):
         ''' Removes random node. Only leaf parent or root can be removed. '''
+        return self.applyMove(self.proposeRemove())
+
+    def proposeRemove(self):
+        ''' Choose a node to turn into a leaf.'''
         # len(leaves) == 1 means tree is empty 
         if len(self.leaves) == 1:
-            return
+            return None
         
-        # list of candidates to remove
         # we can remove only nodes which two sons are leaves
-        nodes = []
-        for leaf in self.leaves:
-            
-            if leaf.parent.right.isLeaf and leaf.parent.left.isLeaf:
-                if nodes.count(leaf.parent) == 0:
-                    nodes.append(leaf.parent)
-        
-        # choose a node and turn it into a leaf
-        chosenNode = nodes[random.randint(0, len(nodes) - 1)]
+        chosenNode = self.prunable.choice()
+        return {'type': "delete", 'node': chosenNode}
+
+    def applyRemove(self, move):
+        chosenNode = move['node']
+        undo = {'type': "delete", 'node': chosenNode, 'data': chosenNode.data,
+                'sons': (chosenNode.left, chosenNode.right), 'sse': self.sse}
+        leftData = chosenNode.left.data
+        rightData = chosenNode.right.data
         chosenNode.data = NodeData()
-        self.leaves.remove(chosenNode.left)
-        self.leaves.remove(chosenNode.right)
-        chosenNode.left = None;
-        chosenNode.right = None;
-        self.leaves.append(chosenNode)
-        chosenNode.isLeaf = True
+        self.detachSons(chosenNode)
+        
+        # only the two merged leaves have to be fitted again
+        if self.sse is not None:
+            self.mergeLeafData(chosenNode, leftData, rightData)
+        return undo
+
+    def snapshot(self):
+        ''' Compact copy of the tree as a FlatTree (parallel arrays). 
+        Fitting data is not part of a snapshot.'''
+        return FlatTree.fromTree(self)
+
+    def restore(self, snapshot):
+        ''' Rebuild the tree from a FlatTree and fit the data into it. Nodes
+        deeper than maxDepth are pruned (e.g. of a warm start from a model
+        of a deeper tree).'''
+        self.idCounter = count(0)
+        self.root = self.newNode()
+        self.resetIndexes()
+        stack = [(self.root, 0)]
+        while stack:
+            node, index = stack.pop()
+            feature = snapshot.feature[index]
+            if feature < 0 or node.depth >= self.maxDepth:
+                continue
+            value = snapshot.threshold[index].item()
+            param = snapshot.featureNames[feature]
+            if self.isParameterValue(param, int):
+                value = int(value)
+            node.data = NodeData(param, value)
+            self.attachSons(node, (self.newNode(node), self.newNode(node)))
+            stack.append((node.right, snapshot.right[index]))
+            stack.append((node.left, snapshot.left[index]))
+        return self.evaluate()
+
+    def preorder(self):
+        ''' Nodes in preorder, the order of nodes of a snapshot.'''
+        nodes = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            if not node.isLeaf:
+                stack.append(node.right)
+                stack.append(node.left)
+        return nodes
+
+    def nodeOrder(self):
+        ''' Order of leaves and prunable nodes in their IndexedSets, as 
+        preorder indices. Random moves depend on it, so it's saved with a 
+        snapshot to continue a run exactly (see restoreOrder).
+        @return (leaf indices, prunable node indices)'''
+        index = dict((node, i) for i, node in enumerate(self.preorder()))
+        return ([index[node] for node in self.leaves],
+                [index[node] for node in self.prunable])
+
+    def restoreOrder(self, order):
+        ''' Reorder leaves and prunable nodes of a restored tree like they
+        were when nodeOrder was saved.'''
+        nodes = self.preorder()
+        leaves, prunable = order
+        self.leaves = IndexedSet(nodes[i] for i in leaves)
+        self.prunable = IndexedSet(nodes[i] for i in prunable)
+
+    def toPredictor(self):
+        ''' Standalone Predictor of the fitted tree (without training data).
+        '''
+        return Predictor.fromTree(self)
+
+    @classmethod
+    def fromFlatTree(cls, flatTree, csvData):
+        ''' Build a tree with a structure of a FlatTree fitted to csvData.'''
+        tree = cls(csvData, flatTree.paramToPredict)
+        tree.restore(flatTree)
+        return tree
         
     def getMinMaxParameterValue(self, csvData):    
         ''' Get minValue and maxValue of parameters.
-        @param csvData: data loaded with csv_loader 
-        @returns Dictionary of parameters and corresponding dictionary with
-        minValue and maxValue.'''
+        @param csvData: Dataset loaded with csv_loader 
+        @returns Dictionary of numeric parameters and corresponding dictionary
+        with minValue and maxValue.'''
 
         minMaxParamValues = {}
-        # find max and min of every parameter
-        parameters = csvData[0].keys()
-        for param in parameters:
-            seq = [x[param] for x in csvData]
-            minMaxParamValues[param] = {"minValue": min(seq), "maxValue": max(seq)}
+        # find max and min of every numeric parameter
+        for param, column in csvData.numericColumns.items():
+            # missing values (NaN) are skipped
+            minMaxParamValues[param] = {"minValue": np.nanmin(column).item(), 
+                                        "maxValue": np.nanmax(column).item()}
         return minMaxParamValues
     
     def computeMeanLeavesValues(self):
-        ''' Computes mean values for every leaf and saves it into meanData 
-        dictionary.'''
+        ''' Computes statistics of the parameter to predict for every leaf 
+        and saves its mean into meanData dictionary.'''
         for leaf in self.leaves:
             self.computeMeanValuesForNode(leaf)
             
     def computeMeanValuesForNode(self, root):
+        ''' Compute count, sum and sum of squares of the parameter to predict 
+        over fittingData of a leaf. Means of other parameters are computed 
+        on demand by leafProfile.'''
         if root.isLeaf == False:
             raise ValueError("Can't compute mean values for a node which is not a leaf!")
-        for param in self.parameters:
-            # can't compute mean when parameter value is a string
-            if self.isParameterValue(param, basestring):
-                pass
+        rows = np.asarray(root.data.fittingData, dtype=np.intp)
+        data = root.data
+        data.count = len(rows)
+        data.sum, data.sumSquares = self.valueStatistics(
+                                        self.targetValues(rows))
+        self.updateLeafMean(data)
+
+    def targetValues(self, rows, csvData=None):
+        ''' Values of the parameter to predict in rows (as floats).'''
+        if csvData is None:
+            csvData = self.csvData
+        return csvData[self.paramToPredict][rows].astype(np.float64)
+
+    def valueStatistics(self, values):
+        ''' @return (sum, sum of squares) of target values'''
+        return values.sum().item(), np.dot(values, values).item()
+
+    def leafProfile(self, leaf, parameters=None):
+        ''' Means of parameters over rows fitted into a leaf, computed when 
+        they are asked for (e.g. to describe leaves of a final tree).
+        @param parameters: numeric parameters (default: all of them)
+        @return dictionary of parameter and its mean (empty for an empty 
+        leaf)'''
+        if parameters is None:
+            parameters = [p for p in self.parameters 
+                          if not self.csvData.isString(p)]
+        rows = np.asarray(leaf.data.fittingData, dtype=np.intp)
+        profile = {}
+        if len(rows) == 0:
+            return profile
+        for param in parameters:
+            if param == self.paramToPredict:
+                profile[param] = leaf.data.meanData[param]
             else:
-                seq = [x[param] for x in root.data.fittingData]
-                if len(seq) == 0:
-                    continue
-                root.data.meanData[param] = (sum(seq) / len(seq))   
+                profile[param] = np.nanmean(self.csvData[param][rows]).item()
+        return profile
+
+    def leafMean(self, leaf, parameter):
+        ''' Mean of a parameter in a leaf (0 for an empty leaf).'''
+        if parameter in leaf.data.meanData:
+            return leaf.data.meanData[parameter]
+        return self.leafProfile(leaf, [parameter]).get(parameter, 0)
                 
     def clearAllFittingData(self):
         for leaf in self.leaves:
-            if leaf.data.fittingData != []:
-                del leaf.data.fittingData[:]
+            leaf.data.fittingData = np.zeros(0, dtype=np.intp)
+            leaf.data.count = 0
+            leaf.data.sum = 0.0
+            leaf.data.sumSquares = 0.0
+        self.sse = None
+
+    def setLeafStatistics(self, leaf, rows):
+        ''' Fit rows into a leaf and compute count, sum and sum of squares of 
+        the parameter to predict.
+        @return sum of squared errors of the leaf'''
+        leaf.data.fittingData = rows
+        self.computeMeanValuesForNode(leaf)
+        return self.leafError(leaf.data)
+
+    def updateLeafMean(self, data):
+        if data.count > 0:
+            data.meanData = {self.paramToPredict: data.sum / data.count}
+        else:
+            data.meanData = {}
+
+    def leafError(self, data):
+        ''' Sum of squared errors of a leaf computed from its statistics.'''
+        if data.count == 0:
+            return 0.0
+        return max(data.sumSquares - data.sum * data.sum / data.count, 0.0)
+
+    def splitLeafData(self, node, leafData):
+        ''' Distribute rows of a former leaf between the two new leaves of node
+        and adjust SSE of the tree by the difference.'''
+        rows = np.asarray(leafData.fittingData, dtype=np.intp)
+        mask = self.csvData[node.data.param][rows] < node.data.value
+        self.sse -= self.leafError(leafData)
+        self.sse += self.setLeafStatistics(node.left, rows[mask])
+        self.sse += self.setLeafStatistics(node.right, rows[~mask])
+
+    def mergeLeafData(self, node, leftData, rightData):
+        ''' Join statistics of two removed leaves into node (a new leaf) and 
+        adjust SSE of the tree by the difference.'''
+        data = node.data
+        data.fittingData = np.concatenate(
+                            [np.asarray(leftData.fittingData, dtype=np.intp),
+                             np.asarray(rightData.fittingData, dtype=np.intp)])
+        data.count = leftData.count + rightData.count
+        data.sum = leftData.sum + rightData.sum
+        data.sumSquares = leftData.sumSquares + rightData.sumSquares
+        self.updateLeafMean(data)
+        self.sse += (self.leafError(data) - self.leafError(leftData) 
+                     - self.leafError(rightData))
                  
     def insertDataCollection(self, collection):
-        for data in collection:
-            self.insertData(data, self.root)
+        ''' Append rows to fittingData of matching leaves. Rows are routed
+        together (see routeRows), not one by one.
+        @param collection: the tree's Dataset or an iterable of its row
+        indices'''
+        if isinstance(collection, Dataset):
+            indices = None
+        else:
+            indices = np.fromiter(collection, dtype=np.intp)
+        self.sse = None
+        for leaf, rows in self.routeRows(indices):
+            leaf.data.fittingData = np.concatenate(
+                                        [leaf.data.fittingData, rows])
             
-    def insertData(self, data, root):
-        if root.isLeaf:
-            root.data.fittingData.append(data)
+    def insertData(self, index, root):
+        ''' Insert a row (given by its index) into a matching leaf.'''
+        data = self.findLeaf(index, root).data
+        data.fittingData = np.append(data.fittingData, np.intp(index))
+
+    def routeRows(self, indices=None, csvData=None):
+        ''' Route many rows down the tree at once. Every node visit splits an
+        index array with a boolean mask, so there is no per-row recursion.
+        @param indices: row indices (default: all rows)
+        @param csvData: Dataset to route (default: the tree's dataset)
+        @return List of (leaf, row indices) pairs.'''
+        routed = []
+        if csvData is None:
+            csvData = self.csvData
+        if (indices is None and not self.root.isLeaf and 
+            csvData is self.csvData):
+            # all rows are split at the root with a binary search
+            left, right = self.featureIndex.splitRows(self.root.data.param,
+                                                      self.root.data.value)
+            stack = [(self.root.right, right), (self.root.left, left)]
+        else:
+            if indices is None:
+                indices = np.arange(len(csvData))
+            stack = [(self.root, indices)]
+        while stack:
+            node, rows = stack.pop()
+            if node.isLeaf:
+                routed.append((node, rows))
+                continue
+            mask = csvData[node.data.param][rows] < node.data.value
+            stack.append((node.right, rows[~mask]))
+            stack.append((node.left, rows[mask]))
+        return routed
+
+    def partitionData(self, indices=None):
+        ''' Replace fittingData of every leaf with rows routed in one pass.'''
+        routed = self.routeRows(indices)
+        for leaf, rows in routed:
+            leaf.data.fittingData = rows
+        return routed
+
+    def groupStatistics(self, routed):
+        ''' Count, sum and sum of squares of the parameter to predict in 
+        every leaf of routed rows (grouped reductions, no per-leaf loop).
+        @param routed: list of (leaf, rows) pairs
+        @return (counts, sums, sumSquares, sum of squared errors)'''
+        counts = np.array([len(rows) for leaf, rows in routed], dtype=np.intp)
+        order = np.concatenate([rows for leaf, rows in routed])
+        values = self.targetValues(order)
+        
+        # one column per target when there are more of them
+        sums = segmentSums(values, counts)
+        sumSquares = segmentSums(values * values, counts)
+        means = sums / np.maximum(counts, 1).reshape((-1,) + 
+                                                     (1,) * (sums.ndim - 1))
+        errors = values - np.repeat(means, counts, axis=0)
+        return counts, sums, sumSquares, self.squaredError(errors)
+
+    def squaredError(self, errors):
+        ''' Sum of squared errors of an array of deviations.'''
+        return np.dot(errors, errors).item()
+
+    def groupErrors(self, counts, sums, sumSquares):
+        ''' Sum of squared errors of every leaf from grouped statistics.'''
+        return np.maximum(sumSquares - sums * sums / np.maximum(counts, 1), 
+                          0.0)
+
+    def storeStatistics(self, data, count, sum, sumSquares):
+        ''' Set statistics of a leaf from grouped statistics.'''
+        data.count = count.item()
+        data.sum = sum.item()
+        data.sumSquares = sumSquares.item()
+        self.updateLeafMean(data)
+
+    def evaluate(self):
+        ''' Fit all rows (or fitRows) into the tree, compute statistics of 
+        the parameter to predict in every leaf and return MSE. Rows are 
+        routed once and leaf statistics come from grouped reductions over 
+        the routed rows. Afterwards insertRandom and removeRandom keep the 
+        fit up to date.'''
+        routed = self.partitionData(self.fitRows)
+        counts, sums, sumSquares, self.sse = self.groupStatistics(routed)
+        for i, (leaf, rows) in enumerate(routed):
+            self.storeStatistics(leaf.data, counts[i], sums[i], 
+                                 sumSquares[i])
+        self.pendingMove = None
+        self.fullRows = {}
+        if self.fitRows is not None:
+            routed = self.routeRows()
+            counts, sums, sumSquares, self.fullSSE = \
+                self.groupStatistics(routed)
+            errors = self.groupErrors(counts, sums, sumSquares)
+            for i, (leaf, rows) in enumerate(routed):
+                self.fullRows[leaf] = (rows, errors[i].item())
+        return self.sse / self.numFittedRows()
+
+    def numFittedRows(self):
+        if self.fitRows is None:
+            return len(self.csvData)
+        return len(self.fitRows)
+
+    def setFitRows(self, indices):
+        ''' Fit the tree to a subset of rows (e.g. a sample scoring moves 
+        cheaply) or to all rows again (None).
+        @return MSE of the fitted rows'''
+        self.fitRows = indices
+        self.fullSSE = None
+        return self.evaluate()
+
+    def rowsError(self, rows):
+        ''' Sum of squared errors of rows fitted into one leaf.'''
+        if len(rows) == 0:
+            return 0.0
+        values = self.targetValues(rows)
+        return self.squaredError(values - values.mean(axis=0))
+
+    def settleFullError(self):
+        ''' Add the change of SSE on all rows made by the last move. Only 
+        all rows of the changed leaves are split or merged, like fitted 
+        rows are by applyMove.'''
+        undo = self.pendingMove
+        if undo is None:
             return
+        node = undo['node']
+        if undo['type'] == "insert":
+            rows, error = self.fullRows.pop(node)
+            mask = self.csvData[node.data.param][rows] < node.data.value
+            left = rows[mask]
+            right = rows[~mask]
+            self.fullRows[node.left] = (left, self.rowsError(left))
+            self.fullRows[node.right] = (right, self.rowsError(right))
+            self.fullSSE += (self.fullRows[node.left][1] + 
+                             self.fullRows[node.right][1] - error)
+            undo['fullRows'] = (rows, error)
         else:
-            if data[root.data.param] < root.data.value:
-                self.insertData(data, root.left)
-            else:
-                self.insertData(data, root.right)
+            left, right = undo['sons']
+            sons = (self.fullRows.pop(left), self.fullRows.pop(right))
+            rows = np.concatenate([sons[0][0], sons[1][0]])
+            self.fullRows[node] = (rows, self.rowsError(rows))
+            self.fullSSE += self.fullRows[node][1] - sons[0][1] - sons[1][1]
+            undo['fullRows'] = sons
+        self.pendingMove = None
+
+    def undoFullRows(self, undo):
+        ''' Revert fullRows changed by settleFullError of a move which is 
+        going to be undone.'''
+        node = undo['node']
+        if undo['type'] == "insert":
+            del self.fullRows[node.left]
+            del self.fullRows[node.right]
+            self.fullRows[node] = undo['fullRows']
+        else:
+            left, right = undo['sons']
+            del self.fullRows[node]
+            self.fullRows[left], self.fullRows[right] = undo['fullRows']
+
+    def getFittedMeanSquaredError(self):
+        ''' MSE of the fitted data, kept up to date by insertRandom and 
+        removeRandom after evaluate() has been called.'''
+        if self.sse is None:
+            return self.evaluate()
+        return self.sse / self.numFittedRows()
+
+    def targetMeanSquaredErrors(self):
+        ''' MSE of every parameter to predict on fitted rows.'''
+        return {self.paramToPredict: self.getFittedMeanSquaredError()}
+
+    def getFullMeanSquaredError(self):
+        ''' MSE of the tree fitted to all rows, also when it's fitted to a 
+        subset of them (leaf statistics are not changed then).'''
+        if self.fitRows is None:
+            return self.getFittedMeanSquaredError()
+        if self.sse is None:
+            self.evaluate()
+        self.settleFullError()
+        return self.fullSSE / len(self.csvData)
 
-    def getMeanSquaredError(self):
+    def evaluateChunks(self, chunks):
+        ''' Fit a stream of Datasets (e.g. csvloader.readChunks) into the 
+        tree and return MSE. Statistics of every leaf are accumulated chunk
+        by chunk, so only one chunk has to be in memory. Rows of the chunks
+        are not kept, so fitted data can't be updated by moves afterwards.
+        Rows without a value to predict are skipped, like by the 
+        constructor.'''
+        for leaf in self.leaves:
+            leaf.data.fittingData = np.zeros(0, dtype=np.intp)
+            leaf.data.count = 0
+            leaf.data.sum = 0.0
+            leaf.data.sumSquares = 0.0
+        self.sse = None
+        n = 0
+        for chunk in chunks:
+            present = self.presentRows(chunk)
+            for leaf, rows in self.routeRows(present, chunk):
+                sums, sumSquares = self.valueStatistics(
+                                        self.targetValues(rows, chunk))
+                leaf.data.count += len(rows)
+                leaf.data.sum = leaf.data.sum + sums
+                leaf.data.sumSquares = leaf.data.sumSquares + sumSquares
+            n += len(chunk) if present is None else len(present)
+        
+        sse = 0.0
+        for leaf in self.leaves:
+            self.updateLeafMean(leaf.data)
+            sse += self.leafError(leaf.data)
+        return sse / n
+
+    def getMeanSquaredError(self, csvData=None):
         ''' Compute MSE.
-        MSE = 1/n * sum_n (prediction_i - trueValue_i)^2'''
+        MSE = 1/n * sum_n (prediction_i - trueValue_i)^2
+        @param csvData: Dataset to compute MSE on (default: the tree's one)'''
+        if csvData is None:
+            csvData = self.csvData
+        present = self.presentRows(csvData)
+        n = len(csvData) if present is None else len(present)
+        mse = self.getSumSquaredError(csvData, present) / n
+        return mse
+
+    def presentRows(self, csvData, parameters=None):
+        ''' Rows of a Dataset which have values of parameters to predict 
+        (missing ones can't be fitted or scored).
+        @param parameters: default: [paramToPredict]
+        @return row indices or None if no value is missing'''
+        if parameters is None:
+            parameters = [self.paramToPredict]
+        present = None
+        for param in parameters:
+            if csvData.pythonType(param) is not float:
+                continue
+            missing = np.isnan(csvData[param])
+            if missing.any():
+                if present is None:
+                    present = ~missing
+                else:
+                    present &= ~missing
+        if present is None:
+            return None
+        return np.flatnonzero(present)
+
+    def getSumSquaredError(self, csvData, indices=None):
+        ''' Sum of squared errors of rows of a Dataset.
+        @param indices: rows to score (default: rows with a value to 
+        predict)'''
+        if indices is None:
+            indices = self.presentRows(csvData)
         parameter = self.paramToPredict
+        target = csvData[parameter]
         sum_n = 0
-        for dataRow in self.csvData:
-            predictionValue = self.predictValue(dataRow, parameter, self.root)
-            trueValue = dataRow[parameter]
-            sum_n += math.pow(predictionValue - trueValue, 2)
-        
-        n = len(self.csvData)
-        mse = sum_n / n
-        return mse
+        for leaf, rows in self.routeRows(indices, csvData):
+            # just in case if there is no parameter mean value in a leaf
+            predictionValue = leaf.data.meanData.get(parameter, 0)
+            errors = target[rows] - predictionValue
+            sum_n += np.dot(errors, errors)
+        return sum_n
+
+    def getMeanSquaredErrorChunks(self, chunks):
+        ''' Compute MSE of a stream of Datasets, accumulated chunk by chunk.'''
+        sum_n = 0
+        n = 0
+        for chunk in chunks:
+            present = self.presentRows(chunk)
+            sum_n += self.getSumSquaredError(chunk, present)
+            n += len(chunk) if present is None else len(present)
+        return sum_n / n
     
+    def findLeaf(self, index, root):
+        ''' Find a leaf which a row (given by its index) fits to.'''
+        while not root.isLeaf:
+            if self.csvData[root.data.param][index] < root.data.value:
+                root = root.left
+            else:
+                root = root.right
+        return root
+
     def predictValue(self, dataRow, parameter, root):
         '''Get prediction value of a given parameter to predict.'''
-        
-        if root.isLeaf:
-            if parameter in root.data.meanData.keys():
-                value = root.data.meanData[parameter]
-                return value
-            else:
-                # just in case if there is no parameter mean value in a leaf
-                return 0
-        else:
+        while not root.isLeaf:
             if dataRow[root.data.param] < root.data.value:
-                return self.predictValue(dataRow, parameter, root.left)
+                root = root.left
             else:
-                return self.predictValue(dataRow, parameter, root.right)
+                root = root.right
+        return self.leafMean(root, parameter)
+
+    def predictValues(self, csvData=None, parameter=None):
+        ''' Predict values of all rows of a Dataset at once.
+        @param csvData: Dataset (default: the tree's one)
+        @param parameter: predicted parameter (default: paramToPredict)
+        @return array of predictions'''
+        if csvData is None:
+            csvData = self.csvData
+        if parameter is None:
+            parameter = self.paramToPredict
+        predictions = np.zeros(len(csvData))
+        for leaf, rows in self.routeRows(csvData=csvData):
+            predictions[rows] = self.leafMean(leaf, parameter)
+        return predictions
          
     def getTreeDepth(self, root):
-        if root.isLeaf == True:
-            return 0
-        else:
-            ldepth = self.getTreeDepth(root.left)
-            rdepth = self.getTreeDepth(root.right)
-            return max(ldepth, rdepth) + 1
+        ''' Depth of a subtree (the depth of the whole tree is kept in 
+        treeDepth).'''
+        depth = 0
+        stack = [(root, 0)]
+        while stack:
+            node, level = stack.pop()
+            if node.isLeaf:
+                depth = max(depth, level)
+            else:
+                stack.append((node.left, level + 1))
+                stack.append((node.right, level + 1))
+        return depth
 
     def size(self, root):
-        if root == None:
-            return 0
-        else:
-            return self.size(root.left) + 1 + self.size(root.right)
+        ''' Number of nodes of a subtree.'''
+        size = 0
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            size += 1
+            stack.append(node.left)
+            stack.append(node.right)
+        return size
 
     def printTree(self, path):
         ''' Generate a graph and save it to a file. '''
-        graph = pydot.Dot(graph_type='graph')
-        self.printNode(self.root, graph)
-        graph.write_png(path)
+        plotting.writeGraph(self.edges(self.root), path)
     
-    def printNode(self, root, graph):
-        if root == None:
-            pass
+    def nodeName(self, node):
+        if not node.isLeaf:
+            return (node.data.param + " id: " + str(node.id) +
+                    "\n%.2f" % node.data.value)
+        name = "Leaf" + " id: " + str(node.id) + "\n"
+        if self.isParameterValue(self.paramToPredict, basestring):
+            # if parameter value is a string, print all matching data
+            for index in node.data.fittingData:
+                name += self.csvData[self.paramToPredict][index] + '\n'
+        elif self.paramToPredict in node.data.meanData: 
+            # print mean value of predicted data
+            name += ("Mean " + self.paramToPredict + ":\n"
+                     + "%.2f" % node.data.meanData[self.paramToPredict])
         else:
-            self.printNode(root.left, graph)
-            if root.parent == None:
-                pass
-            elif root.isLeaf == True:
-                parentNodeName = (root.parent.data.param +
-                                " id: " + str(root.parent.id) +
-                                "\n%.2f" % root.parent.data.value)
-                childNodeName = "Leaf" + " id: " + str(root.id) + "\n"
-                
-                leafParamValue = ""
-                if self.isParameterValue(self.paramToPredict, basestring):
-                    # if parameter value is a string, print all matching data
-                    for data in root.data.fittingData:
-                        leafParamValue += data[self.paramToPredict] + '\n'
-                elif self.paramToPredict in root.data.meanData: 
-                    # print mean value of predicted data
-                    leafParamValue += ("Mean " + self.paramToPredict + ":\n"
-                                 + "%.2f" % root.data.meanData[self.paramToPredict])
-                else:
-                    leafParamValue += "No fitting data"
-                    
-                edge = pydot.Edge(parentNodeName, childNodeName + leafParamValue)
-                graph.add_edge(edge)
-            else:    
-                parentNodeName = (root.parent.data.param + 
-                                  " id: " + str(root.parent.id) +
-                                 "\n%.2f" % root.parent.data.value)
-                childNodeName = (root.data.param + " id: " + str(root.id) + 
-                                 "\n%.2f" % root.data.value)
-                edge = pydot.Edge(parentNodeName, childNodeName)
-                graph.add_edge(edge)
-            self.printNode(root.right, graph)
-            
+            name += "No fitting data"
+        return name
+    
+    def edges(self, root):
+        ''' Edges (parent name, child name) of a subtree in preorder.'''
+        edges = []
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            if node.parent is not None:
+                edges.append((self.nodeName(node.parent), self.nodeName(node)))
+            stack.append(node.right)
+            stack.append(node.left)
+        return edges
 
-    
\ No newline at end of file
+    def printNode(self, root, graph):
+        ''' Add edges of a subtree to a pydot graph.'''
+        import pydot
+        for parentName, childName in self.edges(root):
+            graph.add_edge(pydot.Edge(parentName, childName))
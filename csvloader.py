@@ -2,6 +2,30 @@
 # -*- coding: utf-8 -*- 
 
 import csv
+import hashlib
+import itertools
+import json
+import os
+import shutil
+
+import numpy as np
+
+from dataset import Dataset
+
+# Columns of known datasets and their types (str columns stay strings)
+carSchema = {"Car": str, "MPG": float, "Cylinders": int, 
+             "Displacement": float, "Horsepower": float, "Weight": float,
+             "Acceleration": float, "Model": int, "Origin": str}
+
+cameraSchema = {"Model": str, "Release_date": int, "Max_resolution": float,
+                "Low_resolution": float, "Effective_pixels": float,
+                "Zoom_wide": float, "Zoom_tele": float,
+                "Normal_focus_range": float, "Macro_focus_range": float,
+                "Storage_included": float, "Weight_inc_batteries": float,
+                "Dimensions": float, "Price": float}
+
+# Values treated as missing (NaN in numeric columns)
+missingValues = ("", "NA", "N/A", "NaN", "nan", "?", "NULL", "null")
 
 def printCsv(csv_file):
     with open(csv_file, 'rb') as f:
@@ -9,6 +33,321 @@ def printCsv(csv_file):
         for row in reader:
             print row
 
+def sniffDelimiter(csv_file, delimiters=";,\t|"):
+    ''' Detect a delimiter of a csv file (';' if it can't be detected).'''
+    with open(csv_file, 'rb') as f:
+        sample = f.read(65536)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=delimiters).delimiter
+    except csv.Error:
+        return ';'
+
+def inferSchema(parameters, rows, missing=missingValues):
+    ''' Detect type of every column from sample rows: int if all values are
+    integers, float if all are numbers (or an integer column has missing 
+    values), str otherwise. Missing values are not taken into account.'''
+    schema = {}
+    for param, values in zip(parameters, zip(*rows)):
+        present = [v for v in values if v not in missing]
+        types = (float,) if len(present) < len(values) else (int, float)
+        for valueType in types:
+            try:
+                for value in present:
+                    valueType(value)
+            except ValueError:
+                continue
+            schema[param] = valueType
+            break
+        else:
+            schema[param] = str
+    return schema
+
+def convertColumn(values, valueType, missing=missingValues):
+    ''' Convert a column of strings with one numpy cast. Missing numeric 
+    values become NaN (an integer column with missing values, or with 
+    values which are not integers, becomes a float column).'''
+    if valueType is not int and valueType is not float:
+        return np.array(values, dtype=object)
+    column = np.array(values)
+    isMissing = np.in1d(column, missing)
+    if isMissing.any():
+        return np.where(isMissing, "nan", column).astype(np.float64)
+    if valueType is int:
+        try:
+            return column.astype(np.int64)
+        except ValueError:
+            pass
+    return column.astype(np.float64)
+
+def convertChunk(parameters, rows, schema, missing=missingValues):
+    ''' Convert rows of strings into a Dataset in one pass per column.'''
+    columns = {}
+    for param, values in zip(parameters, zip(*rows)):
+        columns[param] = convertColumn(values, schema.get(param, str), missing)
+    return Dataset(columns, parameters)
+
+def completeRows(reader, width, missing=missingValues):
+    ''' Rows of a csv reader with width values each. Empty rows are 
+    skipped, short rows are padded with the missing marker (their last 
+    values are missing).
+    @raise ValueError: if a row has more than width values'''
+    marker = missing[0] if missing else ""
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < width:
+            row = row + [marker] * (width - len(row))
+        elif len(row) > width:
+            raise ValueError("Line %d has %d values, expected %d!" 
+                             % (reader.line_num, len(row), width))
+        yield row
+
+def readChunks(csv_file, schema=None, chunkSize=65536, delimiter=None,
+               missing=missingValues):
+    ''' Read a csv file in chunks of chunkSize rows. Only one chunk of raw 
+    rows is held in memory at a time.
+    @param schema: dictionary of column types (int, float or str), inferred
+    from the first chunk if not given
+    @param delimiter: detected if not given
+    @param missing: values treated as missing
+    @return generator of Datasets'''
+    if delimiter is None:
+        delimiter = sniffDelimiter(csv_file)
+    with open(csv_file, 'rb') as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        parameters = reader.next()
+        rowsRead = completeRows(reader, len(parameters), missing)
+        while True:
+            rows = list(itertools.islice(rowsRead, chunkSize))
+            if not rows:
+                break
+            if schema is None:
+                schema = inferSchema(parameters, rows, missing)
+            yield convertChunk(parameters, rows, schema, missing)
+
+def loadChunked(csv_file, schema=None, chunkSize=65536, delimiter=None,
+                missing=missingValues):
+    ''' Load a whole csv file, converting it chunk by chunk.'''
+    return Dataset.concatenate(list(readChunks(csv_file, schema, chunkSize,
+                                               delimiter, missing)))
+
+def load(csv_file, schema=None, delimiter=None, missing=missingValues, 
+         chunkSize=65536):
+    ''' Load any csv file with a header row.
+    @param schema: dictionary of column types (int, float or str), columns 
+    which are not listed are inferred from the first chunkSize rows
+    @param delimiter: detected if not given
+    @param missing: values treated as missing (NaN in numeric columns)
+    @return Dataset, types of its columns are detected once and kept in 
+    Dataset.schema'''
+    if schema is not None:
+        with open(csv_file, 'rb') as f:
+            header = f.readline()
+        if delimiter is None:
+            delimiter = sniffDelimiter(csv_file)
+        parameters = csv.reader([header], delimiter=delimiter).next()
+        if any(p not in schema for p in parameters):
+            schema = dict(schema)
+            sample = list(itertools.islice(
+                            readRows(csv_file, delimiter, missing), chunkSize))
+            inferred = inferSchema(parameters, sample, missing)
+            for p in parameters:
+                schema.setdefault(p, inferred[p])
+    return loadChunked(csv_file, schema, chunkSize, delimiter, missing)
+
+def sourceHash(csv_file):
+    ''' SHA-1 of a file.'''
+    sha = hashlib.sha1()
+    with open(csv_file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def cachePath(csv_file):
+    ''' Directory of a binary cache of a csv file.'''
+    return csv_file + ".cache"
+
+def cacheOptions(loadOptions):
+    ''' Options of load() as they are recorded in schema.json of a cache 
+    (types of a schema by their names, lists instead of tuples).'''
+    options = {}
+    for name, value in loadOptions.items():
+        if name == "schema" and value is not None:
+            value = dict((p, t.__name__) for p, t in value.items())
+        elif isinstance(value, tuple):
+            value = list(value)
+        options[name] = value
+    return options
+
+def compileCache(csv_file, cacheDir=None, **loadOptions):
+    ''' Load a csv file and write it as a binary columnar cache: a directory
+    with one .npy file per column and schema.json describing the columns,
+    the source file (size, mtime and SHA-1) and options it was loaded with.
+    String columns are stored as fixed width byte strings, so every column 
+    can be memory-mapped.
+    @param loadOptions: options of load()
+    @return Dataset'''
+    if cacheDir is None:
+        cacheDir = cachePath(csv_file)
+    stat = os.stat(csv_file)
+    csvData = load(csv_file, **loadOptions)
+    
+    header = {"source": os.path.abspath(csv_file), "size": stat.st_size,
+              "mtime": stat.st_mtime, "sha1": sourceHash(csv_file),
+              "numRows": len(csvData), "columns": [],
+              "loadOptions": cacheOptions(loadOptions)}
+    # written next to the cache and renamed, readers never see a partial one
+    tmpDir = cacheDir + ".tmp%d" % os.getpid()
+    if os.path.exists(tmpDir):
+        shutil.rmtree(tmpDir)
+    os.makedirs(tmpDir)
+    for i, param in enumerate(csvData.parameters):
+        column = csvData[param]
+        if csvData.isString(param):
+            column = np.array([str(v) for v in column], dtype='S')
+        fileName = "%d.npy" % i
+        np.save(os.path.join(tmpDir, fileName), column)
+        header["columns"].append({"name": param, "file": fileName,
+                                  "type": csvData.schema[param].__name__})
+    with open(os.path.join(tmpDir, "schema.json"), 'w') as f:
+        json.dump(header, f, indent=1)
+    
+    if os.path.exists(cacheDir):
+        shutil.rmtree(cacheDir)
+    os.rename(tmpDir, cacheDir)
+    return csvData
+
+def readCacheHeader(cacheDir):
+    with open(os.path.join(cacheDir, "schema.json")) as f:
+        return json.load(f)
+
+def writeCacheHeader(cacheDir, header):
+    ''' Replace schema.json of a cache (atomically).'''
+    tmpPath = os.path.join(cacheDir, "schema.json.tmp%d" % os.getpid())
+    with open(tmpPath, 'w') as f:
+        json.dump(header, f, indent=1)
+    os.rename(tmpPath, os.path.join(cacheDir, "schema.json"))
+
+def isCacheValid(csv_file, header, cacheDir=None, **loadOptions):
+    ''' A cache is valid if it was compiled with the same options of load()
+    and the source has the same size and either the same mtime or the same
+    SHA-1 (a file which was only touched is not parsed again).
+    @param cacheDir: cache of the header; when only mtime of the source 
+    changed, the new one is saved there, so the file isn't hashed on 
+    every load
+    @param loadOptions: options of load() the cache is asked for'''
+    if header.get("loadOptions") != cacheOptions(loadOptions):
+        return False
+    stat = os.stat(csv_file)
+    if stat.st_size != header["size"]:
+        return False
+    if stat.st_mtime == header["mtime"]:
+        return True
+    if sourceHash(csv_file) != header["sha1"]:
+        return False
+    if cacheDir is not None:
+        header["mtime"] = stat.st_mtime
+        writeCacheHeader(cacheDir, header)
+    return True
+
+def loadCache(cacheDir, mmap=True):
+    ''' Load a binary cache written by compileCache.
+    @param mmap: memory-map columns instead of reading them (pages are 
+    shared by all processes which map the same cache)'''
+    header = readCacheHeader(cacheDir)
+    columns = {}
+    parameters = []
+    for column in header["columns"]:
+        path = os.path.join(cacheDir, column["file"])
+        # names are kept as byte strings, like the ones read by csv module
+        name = column["name"].encode('utf-8')
+        columns[name] = np.load(path, mmap_mode='r' if mmap else None)
+        parameters.append(name)
+    return Dataset(columns, parameters)
+
+def loadCached(csv_file, cacheDir=None, mmap=True, **loadOptions):
+    ''' Load a csv file through its binary cache. The cache is compiled on
+    the first call and again whenever the source or loadOptions change.
+    @param loadOptions: options of load() used to compile the cache'''
+    if cacheDir is None:
+        cacheDir = cachePath(csv_file)
+    try:
+        if isCacheValid(csv_file, readCacheHeader(cacheDir), cacheDir, 
+                        **loadOptions):
+            return loadCache(cacheDir, mmap)
+    except (IOError, OSError, ValueError, KeyError):
+        # no cache or a broken one
+        pass
+    compileCache(csv_file, cacheDir, **loadOptions)
+    return loadCache(cacheDir, mmap)
+
+def reservoirSample(chunks, size, seed=None):
+    ''' Uniform random sample of rows of a stream of Datasets (e.g.
+    readChunks) without loading the whole stream (reservoir sampling).
+    @return Dataset of at most size rows'''
+    generator = np.random.RandomState(seed)
+    pieces = []
+    # position of the row kept in every slot of the reservoir within pieces
+    owners = np.full(size, -1, dtype=np.intp)
+    seen = 0
+    kept = 0
+    for chunk in chunks:
+        positions = np.arange(seen, seen + len(chunk))
+        # row i replaces a random slot with probability size / (i + 1)
+        slots = np.where(positions < size, positions,
+                         (generator.random_sample(len(chunk)) *
+                          (positions + 1)).astype(np.intp))
+        keep = slots < size
+        rows = np.flatnonzero(keep)
+        if len(rows) > 0:
+            pieces.append(chunk.take(rows))
+            # later rows of a chunk win, as if they were taken one by one
+            owners[slots[keep]] = kept + np.arange(len(rows))
+            kept += len(rows)
+        seen += len(chunk)
+    if not pieces:
+        raise ValueError("Can't sample an empty stream!")
+    return Dataset.concatenate(pieces).take(owners[owners >= 0])
+
+def sampleRows(csvData, size, method="uniform", param=None, strata=10,
+               seed=None):
+    ''' Indices of a random sample of rows of a Dataset.
+    @param method: "uniform" (without replacement) or "stratified" (every
+    quantile stratum of param gets its share of the sample)
+    @param param: numeric parameter defining strata
+    @return sorted row indices'''
+    generator = np.random.RandomState(seed)
+    n = len(csvData)
+    if size >= n:
+        return np.arange(n)
+    if method == "uniform":
+        return np.sort(generator.choice(n, size, replace=False))
+    elif method != "stratified":
+        raise ValueError("Unknown sampling method: %s" % method)
+    values = csvData[param]
+    edges = np.percentile(values[~np.isnan(values)],
+                          np.linspace(0, 100, strata + 1)[1:-1])
+    # missing values (NaN) fall into the last stratum
+    stratum = np.searchsorted(edges, values, side='right')
+    sample = []
+    for s in xrange(strata):
+        rows = np.flatnonzero(stratum == s)
+        k = int(round(size * len(rows) / float(n)))
+        if k > 0:
+            sample.append(generator.choice(rows, min(k, len(rows)),
+                                           replace=False))
+    if not sample:
+        return np.arange(0)
+    return np.sort(np.concatenate(sample))
+
+def readRows(csv_file, delimiter, missing=missingValues):
+    ''' Rows of a csv file without the header (see completeRows).'''
+    with open(csv_file, 'rb') as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        width = len(reader.next())
+        for row in completeRows(reader, width, missing):
+            yield row
+
 def loadCars(csv_file):
     ''' Load cars dataset with following columns:
     Car(STRING) 
@@ -20,76 +359,20 @@ def loadCars(csv_file):
     Acceleration(DOUBLE)
     Model(INT)
     Origin(CAT)
-    @return List of dictionaries with information about car parameters.'''
+    @return Dataset with information about car parameters.'''
     
-    cars = []
-    with open(csv_file, 'rb') as f:
-        reader = csv.reader(f, delimiter=';')
-        parameters = reader.next()
-        for row in reader:
-            car = {}
-            for p in parameters:
-                car[p] = row[parameters.index(p)]
-            cars.append(car)
-    return convertCarData(cars)
+    return load(csv_file, carSchema, delimiter=';')
 
 def loadCameras(csv_file):
-    cameras = []
-    with open(csv_file, 'rb') as f:
-        reader = csv.reader(f, delimiter=';')
-        parameters = reader.next()
-        for row in reader:
-            camera = {}
-            for p in parameters:
-                camera[p] = row[parameters.index(p)]
-            cameras.append(camera)
-    return convertCameraData(cameras)
-
-def convertCameraData(cameras):
-    ''' Converting cameras list of dictionaries. Will parse proper parameters from 
-    strings to float or integer. '''
-
-    for c in cameras:
-        c["Release_date"] = int(c["Release_date"])
-        c["Max_resolution"] = float(c["Max_resolution"])
-        c["Low_resolution"] = float(c["Low_resolution"])
-        c["Effective_pixels"] = float(c["Effective_pixels"])
-        c["Zoom_wide"] = float(c["Zoom_wide"])
-        
-        c["Zoom_tele"] = float(c["Zoom_tele"])
-        c["Normal_focus_range"] = float(c["Normal_focus_range"])
-        c["Macro_focus_range"] = float(c["Macro_focus_range"])
-        c["Storage_included"] = float(c["Storage_included"])
-        c["Weight_inc_batteries"] = float(c["Weight_inc_batteries"])
-        
-        
-        c["Dimensions"] = float(c["Dimensions"])
-        c["Price"] = float(c["Price"])
-    return cameras
-    
-
-def convertCarData(cars):
-    ''' Converting cars list of dictionaries. Will parse proper parameters from 
-    strings to float or integer. '''
-
-    for car in cars:
-        car["MPG"] = float(car["MPG"])
-        car["Cylinders"] = int(car["Cylinders"])
-        car["Displacement"] = float(car["Displacement"])
-        car["Horsepower"] = float(car["Horsepower"])
-        car["Weight"] = float(car["Weight"])
-        car["Acceleration"] = float(car["Acceleration"])
-        car["Model"] = int(car["Model"])
-    return cars
+    return load(csv_file, cameraSchema, delimiter=';')
         
         
 # Tests
 if __name__ == "__main__":
     cars = loadCars("small_cars.csv")
-    for car in cars:
+    for car in cars.rows():
         print car 
         
     cars = loadCars("cars.csv")
-    for car in cars:
+    for car in cars.rows():
         print car 
-        
\ No newline at end of file
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+class Dataset(object):
+    ''' Columnar dataset. Every numeric parameter is kept in one contiguous
+    float64 or int64 array, string parameters are kept in a separate store of
+    object (or fixed width byte string) arrays. Rows are addressed by their 
+    index. Columns may be memory-mapped arrays, they are never copied.'''
+
+    def __init__(self, columns, parameters=None):
+        ''' @param columns: dictionary of parameter name and a sequence of its
+        values (numpy array or list)
+        @param parameters: order of parameters (default: sorted names)'''
+        if parameters is None:
+            parameters = sorted(columns.keys())
+        self.parameters = list(parameters)
+        # numeric columns (float64 or int64 arrays)
+        self.numericColumns = {}
+        # string columns (object arrays)
+        self.stringColumns = {}
+        # python type of every parameter, detected once per column
+        self.schema = {}
+        self.numRows = None
+        # structures derived from the data (e.g. a FeatureIndex), built once
+        self.cache = {}
+        for param in self.parameters:
+            self.addColumn(param, columns[param])
+
+    @classmethod
+    def fromRows(cls, rows):
+        ''' Build a dataset from a list of dictionaries (one per row).'''
+        parameters = list(rows[0].keys())
+        columns = {}
+        for param in parameters:
+            columns[param] = [row[param] for row in rows]
+        return cls(columns, parameters)
+
+    @classmethod
+    def concatenate(cls, datasets):
+        ''' Join datasets with the same parameters (e.g. chunks of a file).'''
+        parameters = datasets[0].parameters
+        columns = {}
+        for param in parameters:
+            columns[param] = np.concatenate([d[param] for d in datasets])
+        return cls(columns, parameters)
+
+    def addColumn(self, param, values):
+        ''' Add a column. Its type is detected once, here.'''
+        if isinstance(values, np.ndarray) and values.dtype.kind in 'fiubS':
+            column = values
+        else:
+            column = np.asarray(values)
+        if column.dtype.kind in 'iub':
+            column = column.astype(np.int64, copy=False)
+            self.numericColumns[param] = column
+            self.schema[param] = int
+        elif column.dtype.kind == 'f':
+            column = column.astype(np.float64, copy=False)
+            self.numericColumns[param] = column
+            self.schema[param] = float
+        elif column.dtype.kind == 'S':
+            self.stringColumns[param] = column
+            self.schema[param] = basestring
+        else:
+            column = np.asarray(values, dtype=object)
+            self.stringColumns[param] = column
+            self.schema[param] = basestring
+        if self.numRows is None:
+            self.numRows = len(column)
+        elif len(column) != self.numRows:
+            raise ValueError("Column %s has %d rows, expected %d!"
+                             % (param, len(column), self.numRows))
+        if param not in self.parameters:
+            self.parameters.append(param)
+
+    def __len__(self):
+        return self.numRows or 0
+
+    def __getitem__(self, param):
+        ''' Get a whole column of a parameter.'''
+        if param in self.numericColumns:
+            return self.numericColumns[param]
+        return self.stringColumns[param]
+
+    def __contains__(self, param):
+        return param in self.numericColumns or param in self.stringColumns
+
+    def isString(self, param):
+        return param in self.stringColumns
+
+    def pythonType(self, param):
+        ''' Python type of the values of a parameter: int, float or
+        basestring.'''
+        return self.schema[param]
+
+    def withoutMissing(self, param):
+        ''' Dataset without rows which miss a value of a numeric parameter
+        (the dataset itself if there are none). The result is cached.'''
+        if self.schema[param] is not float:
+            return self
+        key = ("withoutMissing", param)
+        if key not in self.cache:
+            present = ~np.isnan(self.numericColumns[param])
+            if present.all():
+                self.cache[key] = self
+            else:
+                self.cache[key] = self.take(present)
+        return self.cache[key]
+
+    def row(self, index):
+        ''' Get one row as a dictionary (for printing and compatibility).'''
+        row = {}
+        for param in self.parameters:
+            value = self[param][index]
+            if param in self.numericColumns:
+                value = value.item()
+            row[param] = value
+        return row
+
+    def rows(self):
+        for index in xrange(len(self)):
+            yield self.row(index)
+
+    def take(self, indices):
+        ''' New dataset with rows selected by an index array or mask.'''
+        columns = {}
+        for param in self.parameters:
+            columns[param] = self[param][indices]
+        return Dataset(columns, self.parameters)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+class FeatureIndex(object):
+    ''' Presorted index of numeric parameters of a dataset. For every feature
+    it keeps row indices sorted by value, the sorted values, distinct values
+    and (optionally) quantile bin edges. It's used to propose split values
+    which fall between existing values and to split all rows of a dataset
+    with a binary search.'''
+
+    def __init__(self, csvData, features=None, bins=256):
+        ''' @param features: parameters to index (default: numeric ones)
+        @param bins: number of quantile bins (None to skip them)'''
+        if features is None:
+            features = [p for p in csvData.parameters
+                        if p in csvData.numericColumns]
+        self.features = list(features)
+        self.bins = bins
+        self.order = {}
+        self.sortedValues = {}
+        self.distinct = {}
+        self.quantiles = {}
+        for feature in self.features:
+            column = csvData[feature]
+            order = np.argsort(column, kind='mergesort')
+            sortedValues = column[order]
+            self.order[feature] = order
+            self.sortedValues[feature] = sortedValues
+            # missing values (NaN) are sorted last and never go left
+            distinct = np.unique(sortedValues)
+            self.distinct[feature] = distinct[~np.isnan(distinct)]
+            if bins is not None:
+                present = sortedValues[:np.searchsorted(sortedValues, np.nan)]
+                if len(present) > 0:
+                    edges = np.percentile(present,
+                                          np.linspace(0, 100, bins + 1),
+                                          interpolation='lower')
+                    self.quantiles[feature] = np.unique(edges)
+
+    @classmethod
+    def get(cls, csvData, bins=256):
+        ''' Index of a dataset, built once and cached with the dataset.'''
+        key = ("featureIndex", bins)
+        if key not in csvData.cache:
+            csvData.cache[key] = cls(csvData, bins=bins)
+        return csvData.cache[key]
+
+    def candidates(self, feature, minValue, maxValue, quantile=False):
+        ''' Split values of a feature which leave rows on both sides within
+        a range: values v with minValue < v < maxValue (v == maxValue only if
+        it's the maximum of the dataset, which is inclusive).
+        @param quantile: use quantile bin edges instead of distinct values'''
+        if quantile and feature in self.quantiles:
+            values = self.quantiles[feature]
+        else:
+            values = self.distinct[feature]
+        if len(values) == 0:
+            return values
+        lo = np.searchsorted(values, minValue, side='right')
+        if maxValue >= self.distinct[feature][-1]:
+            hi = np.searchsorted(values, maxValue, side='right')
+        else:
+            hi = np.searchsorted(values, maxValue, side='left')
+        return values[lo:hi]
+
+    def rowCandidates(self, feature, values, quantile=False):
+        ''' Split values of a feature which leave some of given rows on both
+        sides: distinct values of the rows but the smallest one (or quantile
+        bin edges between the smallest and the largest value).
+        @param values: values of the feature in the rows'''
+        present = values[~np.isnan(values)]
+        if len(present) == 0:
+            return present
+        if quantile and feature in self.quantiles:
+            edges = self.quantiles[feature]
+            lo = np.searchsorted(edges, present.min(), side='right')
+            hi = np.searchsorted(edges, present.max(), side='right')
+            return edges[lo:hi]
+        return np.unique(present)[1:]
+
+    def countBelow(self, feature, value):
+        ''' Number of rows with feature value < value (binary search).'''
+        return np.searchsorted(self.sortedValues[feature], value, side='left')
+
+    def splitRows(self, feature, value):
+        ''' Split all rows of the dataset by a feature value.
+        @return (rows with value < value, the other rows)'''
+        k = self.countBelow(feature, value)
+        order = self.order[feature]
+        return order[:k], order[k:]
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+import plotting
+
+class FlatTree(object):
+    ''' Compact tree store. Nodes are kept in preorder in parallel arrays:
+    feature       index of the split parameter in featureNames (-1 for a leaf)
+    threshold     split value (rows with value < threshold go left)
+    left, right   indices of the sons (-1 for a leaf)
+    parent        index of the parent (-1 for the root)
+    value         mean of the predicted parameter in a leaf (nan if empty)
+    count         number of fitted rows in a leaf
+    Ranges of split parameters are not stored, parameterRange computes them
+    when they are asked for.
+    '''
+
+    def __init__(self, featureNames, paramToPredict, size=0):
+        self.featureNames = list(featureNames)
+        self.paramToPredict = paramToPredict
+        self.feature = np.full(size, -1, dtype=np.int32)
+        self.threshold = np.zeros(size)
+        self.left = np.full(size, -1, dtype=np.int32)
+        self.right = np.full(size, -1, dtype=np.int32)
+        self.parent = np.full(size, -1, dtype=np.int32)
+        self.value = np.full(size, np.nan)
+        self.count = np.zeros(size, dtype=np.int64)
+
+    @classmethod
+    def fromTree(cls, tree):
+        ''' Flatten a BinaryTree.'''
+        nodes = []
+        parents = []
+        stack = [(tree.root, -1)]
+        while stack:
+            node, parentIndex = stack.pop()
+            nodes.append(node)
+            parents.append(parentIndex)
+            if not node.isLeaf:
+                index = len(nodes) - 1
+                stack.append((node.right, index))
+                stack.append((node.left, index))
+
+        featureIndex = dict((p, i) for i, p in enumerate(tree.parameters))
+        flat = cls(tree.parameters, tree.paramToPredict, len(nodes))
+        flat.parent[:] = parents
+        for index, node in enumerate(nodes):
+            parentIndex = parents[index]
+            if parentIndex >= 0:
+                # left son is always visited right after its parent
+                if index == parentIndex + 1:
+                    flat.left[parentIndex] = index
+                else:
+                    flat.right[parentIndex] = index
+            if node.isLeaf:
+                flat.count[index] = node.data.count
+                if tree.paramToPredict in node.data.meanData:
+                    flat.value[index] = node.data.meanData[tree.paramToPredict]
+            else:
+                param = node.data.param
+                flat.feature[index] = featureIndex[param]
+                flat.threshold[index] = node.data.value
+        return flat
+
+    def size(self):
+        return len(self.feature)
+
+    def parameterRange(self, index):
+        ''' Range of the split parameter of a node the threshold was chosen
+        from, narrowed by the closest ancestors splitting on it.
+        @return (lower, upper), nan where only the data limits it'''
+        feature = self.feature[index]
+        lower = upper = np.nan
+        child = index
+        parent = self.parent[index]
+        while parent >= 0 and (np.isnan(lower) or np.isnan(upper)):
+            if self.feature[parent] == feature:
+                if child == self.left[parent]:
+                    if np.isnan(upper):
+                        upper = self.threshold[parent]
+                elif np.isnan(lower):
+                    lower = self.threshold[parent]
+            child = parent
+            parent = self.parent[parent]
+        return lower, upper
+
+    def isLeaf(self, index):
+        return self.feature[index] < 0
+
+    def getTreeDepth(self):
+        depth = np.zeros(self.size(), dtype=np.int32)
+        for index in xrange(1, self.size()):
+            depth[index] = depth[self.parent[index]] + 1
+        return depth.max().item() if self.size() > 0 else 0
+
+    def findLeaf(self, dataRow):
+        ''' Index of a leaf which a row (dictionary) fits to.'''
+        index = 0
+        while self.feature[index] >= 0:
+            param = self.featureNames[self.feature[index]]
+            if dataRow[param] < self.threshold[index]:
+                index = self.left[index]
+            else:
+                index = self.right[index]
+        return index
+
+    def predictValue(self, dataRow):
+        ''' Get prediction value of the predicted parameter for a row.'''
+        value = self.value[self.findLeaf(dataRow)]
+        if np.isnan(value):
+            # just in case if there is no parameter mean value in a leaf
+            return 0
+        return value.item()
+
+    def nodeName(self, index):
+        if self.feature[index] >= 0:
+            return (self.featureNames[self.feature[index]] + " id: " +
+                    str(index) + "\n%.2f" % self.threshold[index])
+        name = "Leaf" + " id: " + str(index) + "\n"
+        if self.count[index] > 0:
+            # print mean value of predicted data
+            name += ("Mean " + self.paramToPredict + ":\n"
+                     + "%.2f" % self.value[index])
+        else:
+            name += "No fitting data"
+        return name
+
+    def printTree(self, path):
+        ''' Generate a graph and save it to a file. '''
+        plotting.writeGraph([(self.nodeName(self.parent[index]), 
+                              self.nodeName(index))
+                             for index in xrange(1, self.size())], path)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import random
+
+class IndexedSet(object):
+    ''' Set of objects kept in a list with a dictionary of their positions,
+    so adding, removing and choosing a random item are O(1). Removal moves
+    the last item into the hole, the order of items is not kept.'''
+
+    def __init__(self, items=()):
+        self.items = []
+        self.positions = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if item not in self.positions:
+            self.positions[item] = len(self.items)
+            self.items.append(item)
+
+    def remove(self, item):
+        ''' Remove an item, KeyError if it's not in the set.'''
+        position = self.positions.pop(item)
+        last = self.items.pop()
+        if last is not item:
+            self.items[position] = last
+            self.positions[last] = position
+
+    def discard(self, item):
+        if item in self.positions:
+            self.remove(item)
+
+    def choice(self):
+        ''' Random item of a non-empty set.'''
+        return self.items[random.randint(0, len(self.items) - 1)]
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __contains__(self, item):
+        return item in self.positions
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+''' Binary format of fitted trees. A file starts with a magic line, a line 
+with the length of a JSON header and the header itself (predicted parameter,
+split features and offsets of arrays). Arrays (split feature, threshold, 
+sons, leaf means and leaf counts) follow, aligned to 64 bytes, so a loaded 
+model is a set of views of one memory-mapped file. No training data is 
+stored.'''
+
+import json
+
+import numpy as np
+
+from flattree import FlatTree
+from predictor import Predictor
+
+magic = "RTREE1\n"
+alignment = 64
+arrays = [("feature", "<i4"), ("threshold", "<f8"), ("left", "<i4"),
+          ("right", "<i4"), ("value", "<f8"), ("count", "<i8")]
+
+def toPredictor(model):
+    ''' Predictor of a BinaryTree, FlatTree or Predictor.'''
+    if isinstance(model, Predictor):
+        return model
+    if isinstance(model, FlatTree):
+        return Predictor.fromFlatTree(model)
+    return model.toPredictor()
+
+def saveModel(path, model, meta=None):
+    ''' Save a fitted tree.
+    @param model: BinaryTree, FlatTree or Predictor
+    @param meta: dictionary saved with the model (e.g. MSE of the tree)'''
+    predictor = toPredictor(model)
+    header = {"paramToPredict": predictor.paramToPredict,
+              "featureNames": predictor.featureNames,
+              "size": predictor.size(), "meta": meta or {}, "arrays": {}}
+    
+    offset = 0
+    for name, dtype in arrays:
+        header["arrays"][name] = {"dtype": dtype, "offset": offset}
+        nbytes = predictor.size() * np.dtype(dtype).itemsize
+        offset += -(-nbytes // alignment) * alignment
+    
+    headerText = json.dumps(header)
+    start = len(magic) + 16 + len(headerText)
+    padding = -start % alignment
+    with open(path, 'wb') as f:
+        f.write(magic)
+        f.write("%15d\n" % (len(headerText) + padding))
+        f.write(headerText + " " * padding)
+        dataStart = f.tell()
+        for name, dtype in arrays:
+            f.seek(dataStart + header["arrays"][name]["offset"])
+            f.write(getattr(predictor, name).astype(dtype).tostring())
+        # the last array may be followed by padding only
+        f.truncate(dataStart + offset)
+
+def loadModel(path, mmap=True):
+    ''' Load a model saved by saveModel. With mmap the file is memory-mapped
+    and arrays are views of it, pages are read when they are used.
+    @return Predictor (with 'meta' attribute)'''
+    with open(path, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError("%s is not a model file!" % path)
+        headerLength = int(f.readline())
+        header = json.loads(f.read(headerLength))
+        dataStart = f.tell()
+        if not mmap:
+            data = np.frombuffer(f.read(), dtype=np.uint8)
+    if mmap:
+        data = np.memmap(path, dtype=np.uint8, mode='r', offset=dataStart)
+    
+    size = header["size"]
+    values = {}
+    for name, dtype in arrays:
+        spec = header["arrays"][name]
+        values[name] = np.ndarray((size,), dtype=spec["dtype"], buffer=data,
+                                  offset=spec["offset"])
+    featureNames = [name.encode('utf-8') for name in header["featureNames"]]
+    predictor = Predictor(featureNames, header["paramToPredict"].encode('utf-8'),
+                          values["feature"], values["threshold"],
+                          values["left"], values["right"], values["value"],
+                          values["count"])
+    predictor.meta = header["meta"]
+    return predictor
+
+def loadModels(paths, mmap=True):
+    ''' Load many models, each of them is one memory-mapped file.'''
+    return [loadModel(path, mmap) for path in paths]
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from binarytree import BinaryTree
+from dataset import Dataset
+
+def targetWeights(csvData, parameters, weights=None):
+    ''' Weights of predicted parameters in the combined MSE. By default every
+    parameter is weighted by 1 / (k * its variance), so the combined MSE of
+    a tree with one leaf is 1 and parameters of any scale count the same.
+    @param weights: explicit weights (used as they are)
+    @return array of weights'''
+    if weights is not None:
+        if len(weights) != len(parameters):
+            raise ValueError("Expected %d weights, got %d!"
+                             % (len(parameters), len(weights)))
+        return np.asarray(weights, dtype=np.float64)
+    variances = np.array([np.var(csvData[p]) for p in parameters])
+    variances[variances == 0] = 1.0
+    return 1.0 / (len(parameters) * variances)
+
+class MultiTargetTree(BinaryTree):
+    ''' Regression tree whose leaves predict several parameters at once.
+    One tree structure is fitted to all of them: rows are routed once, leaf
+    statistics keep one column per parameter (count is shared, sum and
+    sumSquares are arrays) and the objective is the weighted sum of MSE of
+    the parameters. paramToPredict is the first of them, it's the one
+    predicted by snapshots, Predictors and model files.'''
+
+    def __init__(self, csvData, parametersToPredict, weights=None):
+        ''' @param parametersToPredict: list of parameters to predict
+        @param weights: weights of the parameters in the combined MSE
+        (default: see targetWeights)'''
+        if isinstance(parametersToPredict, basestring):
+            parametersToPredict = [parametersToPredict]
+        if not isinstance(csvData, Dataset):
+            csvData = Dataset.fromRows(csvData)
+        # rows have to have values of all parameters to predict
+        for param in parametersToPredict[1:]:
+            csvData = csvData.withoutMissing(param)
+        BinaryTree.__init__(self, csvData, parametersToPredict[0])
+        self.paramsToPredict = list(parametersToPredict)
+        self.splitParameters = [p for p in self.splitParameters
+                                if p not in self.paramsToPredict]
+        self.weights = targetWeights(self.csvData, self.paramsToPredict,
+                                     weights)
+
+    def targetMatrix(self):
+        ''' Values of all parameters to predict as one (rows x parameters)
+        array, so every leaf takes its rows of all of them at once. It's
+        cached with the dataset (and shared by its trees).'''
+        key = ("targets", tuple(self.paramsToPredict))
+        cache = self.csvData.cache
+        if key not in cache:
+            cache[key] = np.column_stack([self.csvData[p] for p in
+                                          self.paramsToPredict]
+                                         ).astype(np.float64)
+        return cache[key]
+
+    def targetValues(self, rows, csvData=None):
+        ''' Values of the parameters to predict in rows, one column each.'''
+        if csvData is None or csvData is self.csvData:
+            return self.targetMatrix()[rows]
+        return np.column_stack([csvData[p][rows] for p in
+                                self.paramsToPredict]).astype(np.float64)
+
+    def valueStatistics(self, values):
+        return values.sum(axis=0), np.einsum('ij,ij->j', values, values)
+
+    def squaredError(self, errors):
+        return np.dot(self.weights,
+                      np.einsum('ij,ij->j', errors, errors)).item()
+
+    def groupErrors(self, counts, sums, sumSquares):
+        errors = sumSquares - sums * sums / np.maximum(counts, 1)[:, None]
+        return np.dot(np.maximum(errors, 0.0), self.weights)
+
+    def storeStatistics(self, data, count, sum, sumSquares):
+        data.count = count.item()
+        data.sum = sum.copy()
+        data.sumSquares = sumSquares.copy()
+        self.updateLeafMean(data)
+
+    def updateLeafMean(self, data):
+        if data.count > 0:
+            data.meanData = dict(zip(self.paramsToPredict,
+                                     (data.sum / data.count).tolist()))
+        else:
+            data.meanData = {}
+
+    def targetErrors(self, data):
+        ''' Sum of squared errors of every parameter in a leaf.'''
+        return np.maximum(data.sumSquares - data.sum * data.sum / data.count,
+                          0.0)
+
+    def leafError(self, data):
+        ''' Weighted sum of squared errors of a leaf.'''
+        if data.count == 0:
+            return 0.0
+        return np.dot(self.weights, self.targetErrors(data)).item()
+
+    def presentRows(self, csvData, parameters=None):
+        return BinaryTree.presentRows(self, csvData, self.paramsToPredict)
+
+    def getSumSquaredError(self, csvData, indices=None):
+        if indices is None:
+            indices = self.presentRows(csvData)
+        sum_n = 0
+        for leaf, rows in self.routeRows(indices, csvData):
+            predictions = [leaf.data.meanData.get(p, 0)
+                           for p in self.paramsToPredict]
+            sum_n += self.squaredError(self.targetValues(rows, csvData) -
+                                       predictions)
+        return sum_n
+
+    def targetMeanSquaredErrors(self):
+        ''' MSE of every parameter to predict on fitted rows (without
+        weights).'''
+        if self.sse is None:
+            self.evaluate()
+        sse = np.zeros(len(self.paramsToPredict))
+        for leaf in self.leaves:
+            if leaf.data.count > 0:
+                sse += self.targetErrors(leaf.data)
+        return dict(zip(self.paramsToPredict,
+                        (sse / self.numFittedRows()).tolist()))
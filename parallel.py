@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*- 
+
+import multiprocessing
+import random
+
+import numpy as np
+
+from annealing import simulatedAnnealing, newTree
+from binarytree import BinaryTree
+from featureindex import FeatureIndex
+from profiling import AnnealingStats
+
+# Dataset used by worker processes. It's set before the pool is started, so
+# forked workers share its pages read-only instead of receiving a pickled copy.
+sharedData = {}
+
+# names of traces which are concatenated over segments of a chain
+traceNames = ["allMSE", "allTemp", "worseDecisionMSE", "worseDecisionTemp"]
+
+def runChain(task):
+    ''' Run one segment of one chain in a worker process.
+    @return result of simulatedAnnealing without the fitted bestTree'''
+    (paramToPredict, temperature, finalTemperature, maxDepth, step, 
+     initialTree, seed, weights, proposals) = task
+    result = simulatedAnnealing(sharedData['csvData'], paramToPredict,
+                                temperature=temperature, maxDepth=maxDepth, 
+                                step=step, initialTree=initialTree,
+                                finalTemperature=finalTemperature, seed=seed,
+                                logInterval=None, weights=weights, 
+                                proposals=proposals)
+    # the fitted tree refers to the dataset, send only its snapshot back
+    del result['bestTree']
+    return result
+
+def shareFeatureIndexes(csvData, targets):
+    ''' Build feature indexes of the dataset (and of its copies without 
+    rows missing a predicted parameter, which trees of such parameters 
+    use) before workers are forked, so they are built once and shared.
+    @param targets: parameters to predict (or lists of them)'''
+    FeatureIndex.get(csvData, BinaryTree.quantileBins)
+    for target in targets:
+        data = csvData
+        if isinstance(target, basestring):
+            target = [target]
+        # in the order MultiTargetTree drops them
+        for param in list(target[1:]) + list(target[:1]):
+            data = data.withoutMissing(param)
+        FeatureIndex.get(data, BinaryTree.quantileBins)
+
+def runTarget(task):
+    ''' Run a whole chain of one parameter in a worker process.
+    @return result of simulatedAnnealing without the fitted bestTree'''
+    paramToPredict, options = task
+    result = simulatedAnnealing(sharedData['csvData'], paramToPredict, 
+                                **options)
+    del result['bestTree']
+    return result
+
+def perTargetAnnealing(csvData, targets, processes=None, seed=None, 
+                       **options):
+    ''' Run one annealing chain per parameter to predict in a process pool.
+    The dataset is loaded once and its feature indexes are built once, 
+    every chain shares them with the other ones.
+    @param targets: parameters to predict (a list of parameters is fitted
+    by one multi-target tree)
+    @param options: options of simulatedAnnealing
+    @return dictionary of parameter and its result (like 
+    simulatedAnnealing)'''
+    seeds = random.Random(seed)
+    shareFeatureIndexes(csvData, targets)
+    sharedData['csvData'] = csvData
+    tasks = []
+    for target in targets:
+        taskOptions = dict(options, seed=seeds.randint(0, 2 ** 31),
+                           logInterval=None)
+        tasks.append((target, taskOptions))
+    pool = multiprocessing.Pool(processes)
+    try:
+        chainResults = pool.map(runTarget, tasks)
+    finally:
+        pool.close()
+        pool.join()
+        del sharedData['csvData']
+    
+    results = {}
+    BinaryTree.maxDepth = options.get("maxDepth", 20)
+    for target, result in zip(targets, chainResults):
+        result["bestTree"] = newTree(csvData, target, options.get("weights"))
+        result["bestTree"].restore(result["bestSnapshot"])
+        if not isinstance(target, basestring):
+            target = ",".join(target)
+        results[target] = result
+    return results
+
+def parallelAnnealing(csvData, paramToPredict, temperature=1000, maxDepth=20,
+                      step=1, chains=4, processes=None, exchangeInterval=None,
+                      seed=None, weights=None, proposals=1):
+    ''' Run independent simulated annealing chains in a process pool.
+    @param paramToPredict: parameter or a list of parameters (see 
+    simulatedAnnealing)
+    @param chains: number of chains
+    @param processes: size of the pool (default: number of CPUs)
+    @param exchangeInterval: number of steps after which every chain 
+    continues from the best tree found so far by any chain (default: chains
+    never exchange trees)
+    @param proposals: candidate moves of every step (see simulatedAnnealing)
+    @return result of the best chain (like simulatedAnnealing) with 'chains',
+    a list of per-chain traces and results'''
+    
+    seeds = random.Random(seed)
+    if exchangeInterval is None:
+        segmentLength = temperature
+    else:
+        segmentLength = exchangeInterval * step
+    
+    chainResults = [None] * chains
+    for i in xrange(chains):
+        chainResults[i] = dict((name, np.empty(0)) for name in traceNames)
+        chainResults[i].update({"bestMSE": None, "bestSnapshot": None,
+                                "bestTreeTemp": None, "theWorstMSE": 0,
+                                "steps": 0, "stats": AnnealingStats()})
+    startTrees = [None] * chains
+    
+    # the feature index is built once here and shared with workers as well
+    shareFeatureIndexes(csvData, [paramToPredict])
+    sharedData['csvData'] = csvData
+    pool = multiprocessing.Pool(processes)
+    try:
+        temp = temperature
+        while temp > 0:
+            finalTemperature = max(temp - segmentLength, 0)
+            tasks = [(paramToPredict, temp, finalTemperature, maxDepth, step,
+                      startTrees[i], seeds.randint(0, 2 ** 31), weights,
+                      proposals) 
+                     for i in xrange(chains)]
+            segments = pool.map(runChain, tasks)
+            
+            for chain, segment in zip(chainResults, segments):
+                for name in traceNames:
+                    chain[name] = np.concatenate([chain[name], segment[name]])
+                chain["steps"] += segment["steps"]
+                chain["stats"].merge(segment["stats"])
+                chain["theWorstMSE"] = max(chain["theWorstMSE"], 
+                                           segment["theWorstMSE"])
+                if (chain["bestMSE"] is None or 
+                    segment["bestMSE"] < chain["bestMSE"]):
+                    chain["bestMSE"] = segment["bestMSE"]
+                    chain["bestSnapshot"] = segment["bestSnapshot"]
+                    chain["bestTreeTemp"] = segment["bestTreeTemp"]
+            
+            # every chain continues from its current tree or the best one
+            startTrees = [segment["currentSnapshot"] for segment in segments]
+            if exchangeInterval is not None:
+                bestChain = min(chainResults, key=lambda c: c["bestMSE"])
+                startTrees = [bestChain["bestSnapshot"]] * chains
+            temp = segments[0]["finalTemperature"]
+    finally:
+        pool.close()
+        pool.join()
+        del sharedData['csvData']
+    
+    bestIndex = min(xrange(chains), key=lambda i: chainResults[i]["bestMSE"])
+    result = dict(chainResults[bestIndex])
+    BinaryTree.maxDepth = maxDepth
+    result["bestTree"] = newTree(csvData, paramToPredict, weights)
+    result["bestTree"].restore(result["bestSnapshot"])
+    result["targetMSE"] = result["bestTree"].targetMeanSquaredErrors()
+    result.update({"temperature": temperature, "step": step, 
+                   "bestChain": bestIndex, "chains": chainResults})
+    return result
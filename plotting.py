@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+''' Output layer: plots of annealing runs (matplotlib) and tree graphs 
+(pydot). Both libraries are imported only when something is rendered, so
+fitting doesn't depend on them.'''
+
+import os
+import sys
+
+import tracing
+
+def pyplot(headless=True):
+    ''' matplotlib.pyplot, imported on the first use. Without a display 
+    (headless) the Agg backend is used unless MPLBACKEND chooses another 
+    one.'''
+    import matplotlib
+    # the backend can't be switched once pyplot is imported
+    if (headless and "MPLBACKEND" not in os.environ and 
+        "matplotlib.pyplot" not in sys.modules):
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+def plotResult(result, xlabel, ylabel, pathToSave=None):
+    ''' Plot MSE over temperature.
+    @param result: result of annealing or a path of its trace file'''
+    if isinstance(result, basestring):
+        result = tracing.loadTrace(result)
+    plt = pyplot(headless=pathToSave is not None)
+    from matplotlib.font_manager import FontProperties
+    allMSE = result["allMSE"]
+    theWorstMSE = result["theWorstMSE"]
+    bestMSE = result['bestMSE']
+    tempRange = result['allTemp']
+    worseDecisionChosenMSE = result['worseDecisionMSE']
+    worseDecisionChosenTemp = result['worseDecisionTemp']
+    
+    # clear last image
+    plt.clf()
+    
+    # plot every result
+    plt.plot(tempRange, allMSE)
+    
+    # plot when the worse decision was chosen
+    plt.scatter(worseDecisionChosenTemp, worseDecisionChosenMSE, s=10, 
+                color='m', marker='s', label="Worse decision is chosen")
+    
+    # plot best result
+    plt.plot([result['bestTreeTemp']], [result['bestMSE']], "ro", 
+             label="Best solution")
+    
+    # set axis length
+    plt.axis([tempRange[0],0, bestMSE - (0.05 * bestMSE), 
+              theWorstMSE + (0.05 * theWorstMSE)])
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)   
+
+    fontP = FontProperties()
+    fontP.set_size('small')
+    plt.legend(prop = fontP, loc='upper center', bbox_to_anchor=(0.5, 1.05),
+          ncol=3, fancybox=True, shadow=True)
+    
+    if pathToSave == None:
+        plt.show()
+    else:
+        plt.savefig(pathToSave)
+
+def writeGraph(edges, path):
+    ''' Render a graph of (parent name, child name) edges into a png file.'''
+    import pydot
+    graph = pydot.Dot(graph_type='graph')
+    for parentName, childName in edges:
+        graph.add_edge(pydot.Edge(parentName, childName))
+    graph.write_png(path)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from dataset import Dataset
+from flattree import FlatTree
+
+class Predictor(object):
+    ''' Standalone predictor of a fitted tree. It keeps only split features,
+    thresholds, sons and leaf values in flat arrays (no training data),
+    predicts batches with vectorized traversal and single rows with
+    generated Python code.'''
+    # deeper trees can't be compiled (Python limits nesting of blocks), 
+    # their rows are predicted by a loop over the arrays
+    maxCompiledDepth = 90
+
+    def __init__(self, featureNames, paramToPredict, feature, threshold,
+                 left, right, value, count=None):
+        ''' @param featureNames: names of features used by splits
+        @param feature: index of a split feature of every node (-1 leaf)
+        @param value: prediction of every leaf
+        @param count: number of training rows of every leaf'''
+        self.featureNames = list(featureNames)
+        self.paramToPredict = paramToPredict
+        self.feature = np.asarray(feature, dtype=np.int32)
+        self.threshold = np.asarray(threshold, dtype=np.float64)
+        self.left = np.asarray(left, dtype=np.int32)
+        self.right = np.asarray(right, dtype=np.int32)
+        self.value = np.asarray(value, dtype=np.float64)
+        if count is None:
+            count = np.zeros(len(self.feature), dtype=np.int64)
+        self.count = np.asarray(count, dtype=np.int64)
+        # generated row function, compiled on the first predictRow call
+        self.compiledRow = None
+
+    @classmethod
+    def fromFlatTree(cls, flatTree):
+        ''' Predictor of a FlatTree. Only features used by splits are kept
+        and empty leaves predict 0.'''
+        used = sorted(set(flatTree.feature[flatTree.feature >= 0].tolist()))
+        remap = np.full(len(flatTree.featureNames) + 1, -1, dtype=np.int32)
+        remap[used] = np.arange(len(used))
+        # index -1 (leaf) is mapped by the last element to -1
+        feature = remap[flatTree.feature]
+        value = np.where(np.isnan(flatTree.value), 0, flatTree.value)
+        return cls([flatTree.featureNames[i] for i in used],
+                   flatTree.paramToPredict, feature, flatTree.threshold,
+                   flatTree.left, flatTree.right, value, flatTree.count)
+
+    @classmethod
+    def fromTree(cls, tree):
+        ''' Predictor of a fitted BinaryTree.'''
+        return cls.fromFlatTree(FlatTree.fromTree(tree))
+
+    def toFlatTree(self):
+        ''' FlatTree with the structure of the predictor (e.g. to warm-start
+        annealing with BinaryTree.restore).'''
+        flat = FlatTree(self.featureNames, self.paramToPredict, self.size())
+        flat.feature[:] = self.feature
+        flat.threshold[:] = self.threshold
+        flat.left[:] = self.left
+        flat.right[:] = self.right
+        flat.count[:] = self.count
+        flat.value[:] = np.where(self.count > 0, self.value, np.nan)
+        inner = self.feature >= 0
+        flat.parent[self.left[inner]] = np.flatnonzero(inner)
+        flat.parent[self.right[inner]] = np.flatnonzero(inner)
+        return flat
+
+    def size(self):
+        return len(self.feature)
+
+    def featureMatrix(self, batch):
+        ''' Matrix (rows x used features) of a batch: a Dataset or dictionary
+        of columns, or a 2D array which already has columns of featureNames.
+        '''
+        if isinstance(batch, np.ndarray):
+            return np.asarray(batch, dtype=np.float64)
+        if not self.featureNames:
+            # the tree is a single leaf
+            if isinstance(batch, Dataset):
+                return np.empty((len(batch), 0))
+            return np.empty((len(next(iter(batch.values()))), 0))
+        return np.column_stack([np.asarray(batch[name], dtype=np.float64)
+                                for name in self.featureNames])
+
+    def predict(self, batch):
+        ''' Predict values of many rows at once. All rows move down one
+        level of the tree per iteration, so the loop runs at most depth
+        times.
+        @return array of predictions'''
+        X = self.featureMatrix(batch)
+        n = X.shape[0]
+        nodes = np.zeros(n, dtype=np.int32)
+        active = np.arange(n)
+        while len(active) > 0:
+            current = nodes[active]
+            features = self.feature[current]
+            inner = features >= 0
+            active = active[inner]
+            current = current[inner]
+            goLeft = X[active, features[inner]] < self.threshold[current]
+            nodes[active] = np.where(goLeft, self.left[current],
+                                     self.right[current])
+        return self.value[nodes]
+
+    def predictRow(self, row):
+        ''' Predict a value of one row (a dictionary).'''
+        if self.compiledRow is None:
+            if self.toFlatTree().getTreeDepth() > self.maxCompiledDepth:
+                self.compiledRow = self.walkRow
+            else:
+                self.compiledRow = self.compile()
+        return self.compiledRow(row)
+
+    def walkRow(self, row):
+        ''' Predict a value of one row by walking the arrays.'''
+        index = 0
+        while self.feature[index] >= 0:
+            if (row[self.featureNames[self.feature[index]]] < 
+                self.threshold[index]):
+                index = self.left[index]
+            else:
+                index = self.right[index]
+        return self.value[index].item()
+
+    def generateSource(self, name="predictRow"):
+        ''' Python source of a function predicting one row (a dictionary)
+        with straight-line comparisons.'''
+        lines = ["def %s(row):" % name]
+        stack = [(0, 1)]
+        while stack:
+            item, indent = stack.pop()
+            prefix = "    " * indent
+            if isinstance(item, str):
+                lines.append(prefix + item)
+            elif self.feature[item] < 0:
+                lines.append(prefix + "return %r" % self.value[item].item())
+            else:
+                lines.append(prefix + "if row[%r] < %r:" % (
+                                self.featureNames[self.feature[item]],
+                                self.threshold[item].item()))
+                stack.append((self.right[item].item(), indent + 1))
+                stack.append(("else:", indent))
+                stack.append((self.left[item].item(), indent + 1))
+        return "\n".join(lines) + "\n"
+
+    def compile(self):
+        ''' Compile generateSource into a function.'''
+        namespace = {}
+        exec compile(self.generateSource(), "<predictor>", "exec") in namespace
+        return namespace["predictRow"]
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        # generated code is compiled again after unpickling
+        state["compiledRow"] = None
+        return state
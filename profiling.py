@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+''' Instrumentation of simulated annealing: per-phase timers and counters of
+moves, and hooks running a function under cProfile or a sampling profiler.'''
+
+import collections
+import cProfile
+import pstats
+import signal
+import time
+
+class AnnealingStats(object):
+    ''' Cumulative time spent in phases of annealing steps and counters of
+    moves. Phases are timed by laps: lap(phase) adds the time since the
+    previous lap (or mark) to the phase. Accepted moves include the
+    acceptedWorse ones; maxDepthHits are steps forced to remove a node;
+    fullChecks are moves scored on all rows after passing a sample.'''
+
+    phases = ["propose", "apply", "evaluate", "best", "accept", "trace",
+              "schedule", "checkpoint"]
+    counterNames = ["proposed", "accepted", "acceptedWorse", "rejected",
+                    "noMove", "emptyLeafSplits", "maxDepthHits", 
+                    "fullChecks"]
+
+    def __init__(self, timing=True):
+        ''' @param timing: measure phases (counters are always kept)'''
+        self.timing = timing
+        self.timers = dict((phase, 0.0) for phase in self.phases)
+        self.counters = dict((name, 0) for name in self.counterNames)
+        self.steps = 0
+        self.last = None
+
+    def mark(self):
+        ''' Start timing of the next lap.'''
+        if self.timing:
+            self.last = time.time()
+
+    def lap(self, phase):
+        if self.timing:
+            now = time.time()
+            self.timers[phase] += now - self.last
+            self.last = now
+
+    def merge(self, other):
+        ''' Add timers and counters of another run (e.g. a chain segment).'''
+        for phase, seconds in other.timers.items():
+            self.timers[phase] = self.timers.get(phase, 0.0) + seconds
+        for name, value in other.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        self.steps += other.steps
+
+    def toDict(self):
+        return {"steps": self.steps, "timers": dict(self.timers),
+                "counters": dict(self.counters)}
+
+    def summary(self):
+        ''' Human readable table of timers and counters.'''
+        total = sum(self.timers.values())
+        lines = ["Steps: %d" % self.steps]
+        if self.timing:
+            lines.append("%-12s %10s %7s %12s" % ("phase", "seconds", "%",
+                                                "us/step"))
+            for phase in self.phases:
+                seconds = self.timers[phase]
+                lines.append("%-12s %10.3f %6.1f%% %12.2f" % (
+                    phase, seconds, 100.0 * seconds / total if total else 0,
+                    1e6 * seconds / self.steps if self.steps else 0))
+            lines.append("%-12s %10.3f" % ("total", total))
+        for name in self.counterNames:
+            lines.append("%-16s %d" % (name, self.counters[name]))
+        return "\n".join(lines)
+
+def runProfiled(func, args=(), kwargs=None, path=None, top=20):
+    ''' Run a function under cProfile, print the top functions by cumulative
+    time and optionally dump the statistics to path (for pstats or
+    snakeviz).
+    @return result of the function'''
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, *args, **(kwargs or {}))
+    if path is not None:
+        profiler.dump_stats(path)
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(top)
+    return result
+
+class SamplingProfiler(object):
+    ''' Statistical profiler: every interval seconds of CPU time the current
+    stack is sampled (with a profiling timer signal, so it works only in the
+    main thread on Unix). Overhead is low enough for long runs.'''
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self.total = 0
+
+    def sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("%s:%s" % (code.co_filename.split("/")[-1],
+                                    code.co_name))
+            frame = frame.f_back
+        self.samples[tuple(reversed(stack))] += 1
+        self.total += 1
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def functionCounts(self):
+        ''' Number of samples in which every function was on the stack
+        (inclusive) and on top of it (self).'''
+        inclusive = collections.Counter()
+        own = collections.Counter()
+        for stack, count in self.samples.items():
+            for function in set(stack):
+                inclusive[function] += count
+            own[stack[-1]] += count
+        return inclusive, own
+
+    def summary(self, top=20):
+        inclusive, own = self.functionCounts()
+        lines = ["%8s %8s  function (%d samples)" % ("total%", "self%",
+                                                    self.total)]
+        for function, count in inclusive.most_common(top):
+            lines.append("%7.1f%% %7.1f%%  %s" % (
+                100.0 * count / self.total, 100.0 * own[function] / self.total,
+                function))
+        return "\n".join(lines)
+
+def runSampled(func, args=(), kwargs=None, interval=0.005, top=20):
+    ''' Run a function under SamplingProfiler and print its summary.
+    @return result of the function'''
+    profiler = SamplingProfiler(interval)
+    profiler.start()
+    try:
+        result = func(*args, **(kwargs or {}))
+    finally:
+        profiler.stop()
+    print profiler.summary(top)
+    return result
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+''' Cooling schedules and stop criteria of simulated annealing. A schedule
+gives the next temperature after every step; annealing ends when the
+temperature drops to 0 (schedules which never get there return 0 below
+their minTemperature) or when a stop criterion is met.'''
+
+import math
+import time
+
+class LinearSchedule(object):
+    ''' Temperature decreases by a fixed step.'''
+
+    def __init__(self, step=1):
+        self.step = step
+
+    def next(self, temp, accepted, improved):
+        ''' @param accepted: the last move was accepted
+        @param improved: the last move found a new best tree'''
+        return temp - self.step
+
+class GeometricSchedule(object):
+    ''' Temperature is multiplied by alpha after every step.'''
+
+    def __init__(self, alpha=0.99, minTemperature=1e-3):
+        self.alpha = alpha
+        self.minTemperature = minTemperature
+
+    def next(self, temp, accepted, improved):
+        temp *= self.alpha
+        if temp < self.minTemperature:
+            return 0
+        return temp
+
+class LogarithmicSchedule(object):
+    ''' T_k = T_0 / (1 + c * log(1 + k)), k is the number of steps. It 
+    cools too slowly to reach minTemperature in any practical number of 
+    steps, so it ends after maxSteps steps (if given).'''
+
+    def __init__(self, temperature, c=1.0, minTemperature=1e-3, 
+                 maxSteps=None):
+        self.temperature = temperature
+        self.c = c
+        self.minTemperature = minTemperature
+        self.maxSteps = maxSteps
+        self.k = 0
+
+    def next(self, temp, accepted, improved):
+        self.k += 1
+        temp = self.temperature / (1 + self.c * math.log(1 + self.k))
+        if temp < self.minTemperature or (self.maxSteps is not None and 
+                                          self.k >= self.maxSteps):
+            return 0
+        return temp
+
+class ReheatingSchedule(object):
+    ''' Another schedule which is reheated (temperature multiplied by
+    factor, at most to maxTemperature) when there is no new best tree for
+    patience steps.'''
+
+    def __init__(self, schedule, patience=500, factor=2.0, maxTemperature=None,
+                 maxReheats=10):
+        self.schedule = schedule
+        self.patience = patience
+        self.factor = factor
+        self.maxTemperature = maxTemperature
+        self.maxReheats = maxReheats
+        self.reheats = 0
+        self.stepsSinceImprovement = 0
+
+    def next(self, temp, accepted, improved):
+        if improved:
+            self.stepsSinceImprovement = 0
+        else:
+            self.stepsSinceImprovement += 1
+        newTemp = self.schedule.next(temp, accepted, improved)
+        if (self.stepsSinceImprovement >= self.patience and
+            self.reheats < self.maxReheats and newTemp > 0):
+            newTemp *= self.factor
+            if self.maxTemperature is not None:
+                newTemp = min(newTemp, self.maxTemperature)
+            self.reheats += 1
+            self.stepsSinceImprovement = 0
+        return newTemp
+
+class AdaptiveSchedule(object):
+    ''' Geometric schedule which adapts its cooling rate to the acceptance
+    rate of the last window steps: it cools faster while more than
+    targetRate of moves are accepted and slower when fewer are.'''
+
+    def __init__(self, targetRate=0.3, window=100, alpha=0.99,
+                 minAlpha=0.9, maxAlpha=0.9999, minTemperature=1e-3):
+        self.targetRate = targetRate
+        self.window = window
+        self.alpha = alpha
+        self.minAlpha = minAlpha
+        self.maxAlpha = maxAlpha
+        self.minTemperature = minTemperature
+        self.accepted = 0
+        self.steps = 0
+
+    def next(self, temp, accepted, improved):
+        self.steps += 1
+        if accepted:
+            self.accepted += 1
+        if self.steps == self.window:
+            rate = float(self.accepted) / self.steps
+            # distance of 1 - alpha to 1 is halved or doubled
+            if rate > self.targetRate:
+                self.alpha = max(self.minAlpha, 1 - (1 - self.alpha) * 2)
+            else:
+                self.alpha = min(self.maxAlpha, 1 - (1 - self.alpha) / 2)
+            self.accepted = 0
+            self.steps = 0
+        temp *= self.alpha
+        if temp < self.minTemperature:
+            return 0
+        return temp
+
+class NoImprovementStop(object):
+    ''' Stop when no new best tree was found for a number of steps.'''
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    def check(self, steps, stepsSinceImprovement, elapsed):
+        return stepsSinceImprovement >= self.steps
+
+class TimeBudgetStop(object):
+    ''' Stop after a number of seconds of wall-clock time.'''
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def check(self, steps, stepsSinceImprovement, elapsed):
+        return elapsed >= self.seconds
+
+class MaxStepsStop(object):
+    ''' Stop after a number of steps.'''
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    def check(self, steps, stepsSinceImprovement, elapsed):
+        return steps >= self.steps
+
+class Stopwatch(object):
+    ''' Evaluates stop criteria, time is measured from its creation.'''
+
+    def __init__(self, criteria):
+        self.criteria = list(criteria or [])
+        self.start = time.time()
+
+    def shouldStop(self, steps, stepsSinceImprovement):
+        if not self.criteria:
+            return False
+        elapsed = time.time() - self.start
+        for criterion in self.criteria:
+            if criterion.check(steps, stepsSinceImprovement, elapsed):
+                return True
+        return False
+
+def parseSchedule(spec, temperature, step):
+    ''' Schedule from a command line argument: linear, geometric[:alpha],
+    log[:c], adaptive[:targetRate] or reheat[:patience] (reheated linear
+    schedule). The log schedule makes as many steps as the linear one 
+    (temperature / step).'''
+    name, _, arg = spec.partition(":")
+    if name == "linear":
+        return LinearSchedule(step)
+    elif name == "geometric":
+        return GeometricSchedule(float(arg or 0.99))
+    elif name == "log":
+        return LogarithmicSchedule(temperature, float(arg or 1.0),
+                                   maxSteps=int(math.ceil(temperature / 
+                                                          float(step))))
+    elif name == "adaptive":
+        return AdaptiveSchedule(float(arg or 0.3))
+    elif name == "reheat":
+        return ReheatingSchedule(LinearSchedule(step), int(arg or 500),
+                                 maxTemperature=temperature)
+    raise ValueError("Unknown cooling schedule: %s" % spec)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*- 
+
+import csvloader
+from annealing import simulatedAnnealing
+from parallel import shareFeatureIndexes
+
+import getopt
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+# Datasets used by worker processes, loaded once before the pool is started
+# and shared with forked workers.
+sharedData = {}
+
+# grid of test.py
+carParams = ["Horsepower", "Cylinders", "Displacement", "Weight", 
+             "Acceleration", "Model"]
+cameraParams = ["Release_date", "Max_resolution", "Low_resolution",
+                "Effective_pixels", "Zoom_wide", "Zoom_tele", 
+                "Normal_focus_range", "Macro_focus_range", "Storage_included",
+                "Weight_inc_batteries", "Dimensions", "Price"]
+defaultDatasets = [("cars.csv", carParams), ("camera.csv", cameraParams)]
+defaultTemperatures = [50, 100, 500]
+defaultMaxDepths = [10, 20, 30]
+
+def makeGrid(datasets, temperatures, maxDepths, steps=(1,), joint=False):
+    ''' List of runs for every combination of parameters.
+    @param datasets: list of (input csv, list of parameters to predict)
+    @param joint: one run predicting all parameters of a dataset by one 
+    tree (see MultiTargetTree) instead of one run per parameter'''
+    runs = []
+    for ifile, params in datasets:
+        if joint:
+            params = [list(params)]
+        for maxDepth in maxDepths:
+            for temperature in temperatures:
+                for step in steps:
+                    for param in params:
+                        runs.append({"input": ifile, "param": param, 
+                                     "temperature": temperature, 
+                                     "maxDepth": maxDepth, "step": step})
+    return runs
+
+def quietWorker():
+    ''' Worker initializer: annealing progress of many runs is just noise.'''
+    sys.stdout = open(os.devnull, 'w')
+
+def runExperiment(run):
+    ''' Run one annealing in a worker process.
+    @return record of the run (traces are kept only if plots are wanted)'''
+    start = time.time()
+    result = simulatedAnnealing(sharedData[run["input"]], run["param"],
+                                temperature=run["temperature"], 
+                                maxDepth=run["maxDepth"], step=run["step"],
+                                logInterval=None)
+    record = dict(run)
+    record.update({"bestMSE": result["bestMSE"], 
+                   "bestTreeTemp": result["bestTreeTemp"],
+                   "iterations": result["steps"],
+                   "targetMSE": result["targetMSE"],
+                   "stats": result["stats"].toDict(),
+                   "seconds": time.time() - start})
+    if sharedData.get("keepTraces"):
+        for name in ["allMSE", "allTemp", "worseDecisionMSE", 
+                     "worseDecisionTemp", "theWorstMSE", "bestMSE", 
+                     "bestTreeTemp"]:
+            record.setdefault("result", {})[name] = result[name]
+    return record
+
+def runSweep(runs, resultsPath="results.jsonl", processes=None, plot=False,
+             useCache=False):
+    ''' Run all runs in a process pool. Each dataset is loaded once, results
+    are written as JSON lines (one per run, in order of completion).
+    @param plot: render plots of all runs after the sweep
+    @param useCache: load datasets through their binary caches
+    @return list of run records'''
+    start = time.time()
+    for ifile in set(run["input"] for run in runs):
+        if useCache:
+            sharedData[ifile] = csvloader.loadCached(ifile)
+        else:
+            sharedData[ifile] = csvloader.load(ifile)
+        # feature indexes are shared by runs of all parameters
+        shareFeatureIndexes(sharedData[ifile], 
+                            [run["param"] for run in runs 
+                             if run["input"] == ifile])
+    sharedData["keepTraces"] = plot
+    
+    records = []
+    pool = multiprocessing.Pool(processes, initializer=quietWorker)
+    try:
+        with open(resultsPath, 'w') as f:
+            for record in pool.imap_unordered(runExperiment, runs):
+                trace = record.pop("result", None)
+                f.write(json.dumps(record, sort_keys=True) + "\n")
+                f.flush()
+                record["result"] = trace
+                records.append(record)
+                print ("%s %s t=%s d=%s s=%s: MSE %f (%.2fs)" 
+                       % (record["input"], paramName(record["param"]), 
+                          record["temperature"], record["maxDepth"], 
+                          record["step"], 
+                          record["bestMSE"], record["seconds"]))
+    finally:
+        pool.close()
+        pool.join()
+        sharedData.clear()
+    print "Sweep of %d runs took %.2fs" % (len(runs), time.time() - start)
+    
+    if plot:
+        plotSweep(records)
+    return records
+
+def paramName(param):
+    ''' Name of a parameter to predict or of a list of them.'''
+    if isinstance(param, basestring):
+        return param
+    return ",".join(param)
+
+def plotSweep(records, root="img/"):
+    ''' Render plots of sweep records to the default plot paths.'''
+    from annealing import defaultPlotPath
+    from plotting import plotResult
+    for record in records:
+        param = paramName(record["param"])
+        path = defaultPlotPath(record["input"], param, record["temperature"],
+                               record["maxDepth"], root=root, 
+                               step=record["step"])
+        plotResult(record["result"], "Temperature", 
+                   param + " Mean Squared Error", pathToSave=path)
+
+def usage():
+    print("""Usage: %s [-o results.jsonl] [-j arg] [-t list] [-d list] 
+        [-s list] [-g] [-b] [-M] [input.csv:param,param ...]""" 
+          % sys.argv[0])
+    print ""
+    print "-o: results file, JSON lines (default: results.jsonl)"
+    print "-j: number of worker processes (default: number of CPUs)"
+    print "-t: temperature values (default: 50,100,500)"
+    print "-d: max tree depths (default: 10,20,30)"
+    print "-s: step sizes (default: 1)"
+    print "-g: render plots of every run into img/"
+    print "-b: load inputs through binary caches (input.csv.cache/)"
+    print "-M: predict all parameters of an input by one tree per run"
+    print "Without inputs the whole cars and cameras grid is run."
+    
+    print "\nExample:"
+    print "$ python sweep.py -t 50,100 -d 10 cars.csv:Weight,MPG -o cars.jsonl"
+
+if __name__ == "__main__":
+    resultsPath = "results.jsonl"
+    processes = None
+    temperatures = defaultTemperatures
+    maxDepths = defaultMaxDepths
+    steps = [1]
+    plot = False
+    useCache = False
+    joint = False
+    
+    try:
+        myopts, args = getopt.getopt(sys.argv[1:], "o:j:t:d:s:gbMh")
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+    
+    for option, arg in myopts:
+        if option == '-o':
+            resultsPath = arg
+        elif option == '-j':
+            processes = int(arg)
+        elif option == '-t':
+            temperatures = [int(t) for t in arg.split(",")]
+        elif option == '-d':
+            maxDepths = [int(d) for d in arg.split(",")]
+        elif option == '-s':
+            steps = [float(s) for s in arg.split(",")]
+        elif option == '-g':
+            plot = True
+        elif option == '-b':
+            useCache = True
+        elif option == '-M':
+            joint = True
+        else:
+            usage()
+            sys.exit(0)
+    
+    datasets = defaultDatasets
+    if args:
+        datasets = []
+        for arg in args:
+            ifile, params = arg.split(":")
+            datasets.append((ifile, params.split(",")))
+    
+    runs = makeGrid(datasets, temperatures, maxDepths, steps, joint)
+    runSweep(runs, resultsPath=resultsPath, processes=processes, plot=plot,
+             useCache=useCache)
+    print "Results saved in: ", resultsPath
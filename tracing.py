@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+''' Traces of simulated annealing kept in numpy arrays instead of growing
+Python lists, and a rate-limited progress log.'''
+
+import time
+
+import numpy as np
+
+class TraceBuffer(object):
+    ''' Records of (temperature, MSE) pairs in preallocated arrays. Without
+    a capacity the arrays grow by doubling; with a capacity and ring=True
+    only the last capacity records are kept, otherwise records over the
+    capacity are dropped. A buffer with capacity 0 keeps nothing.'''
+
+    def __init__(self, capacity=None, ring=False, initialSize=1024):
+        self.capacity = capacity
+        self.ring = ring
+        size = initialSize if capacity is None else capacity
+        self.temp = np.empty(size)
+        self.mse = np.empty(size)
+        # number of records ever appended
+        self.count = 0
+
+    def append(self, temp, mse):
+        size = len(self.temp)
+        if self.count < size:
+            index = self.count
+        elif self.capacity is None:
+            self.temp = np.resize(self.temp, 2 * size)
+            self.mse = np.resize(self.mse, 2 * size)
+            index = self.count
+        elif self.ring and size > 0:
+            index = self.count % size
+        else:
+            return
+        self.temp[index] = temp
+        self.mse[index] = mse
+        self.count += 1
+
+    def __len__(self):
+        return min(self.count, len(self.temp))
+
+    def __getstate__(self):
+        ''' Only filled records are pickled (e.g. into checkpoints), not the
+        unused part of the arrays.'''
+        n = len(self)
+        state = dict(self.__dict__)
+        state["temp"] = self.temp[:n].copy()
+        state["mse"] = self.mse[:n].copy()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        n = len(self.temp)
+        size = self.capacity if self.capacity is not None else max(n, 1)
+        if size > n:
+            self.temp = np.resize(self.temp, size)
+            self.mse = np.resize(self.mse, size)
+
+    def arrays(self):
+        ''' @return (temperatures, MSEs) in order of recording'''
+        n = len(self)
+        if self.ring and self.count > n > 0:
+            start = self.count % n
+            order = np.r_[start:n, 0:start]
+            return self.temp[order], self.mse[order]
+        return self.temp[:n].copy(), self.mse[:n].copy()
+
+class Trace(object):
+    ''' Trace of an annealing run: MSE of the current tree at every
+    decimation-th step and MSE of every worse decision which was chosen.
+    decimation=0 or capacity=0 turns tracing off.'''
+
+    def __init__(self, decimation=1, capacity=None, ring=False):
+        ''' @param decimation: record every n-th step
+        @param capacity: maximum number of records of each buffer (default:
+        unlimited)
+        @param ring: keep the last records instead of the first ones'''
+        self.decimation = decimation
+        self.enabled = decimation > 0 and capacity != 0
+        self.steps = TraceBuffer(capacity, ring)
+        self.worseDecisions = TraceBuffer(capacity, ring)
+        self.stepCounter = 0
+
+    def recordStep(self, temp, mse):
+        if self.stepCounter % self.decimation == 0:
+            self.steps.append(temp, mse)
+        self.stepCounter += 1
+
+    def recordWorseDecision(self, temp, mse):
+        self.worseDecisions.append(temp, mse)
+
+    def toResult(self):
+        ''' Traces under keys of an annealing result (allTemp, allMSE,
+        worseDecisionTemp, worseDecisionMSE).'''
+        allTemp, allMSE = self.steps.arrays()
+        worseTemp, worseMSE = self.worseDecisions.arrays()
+        return {"allTemp": allTemp, "allMSE": allMSE,
+                "worseDecisionTemp": worseTemp, "worseDecisionMSE": worseMSE}
+
+def saveTrace(path, result):
+    ''' Save traces of an annealing result with values needed by plotResult
+    to a binary (.npz) file.'''
+    arrays = {}
+    for name in ["allTemp", "allMSE", "worseDecisionTemp", "worseDecisionMSE"]:
+        arrays[name] = np.asarray(result[name], dtype=np.float64)
+    for name in ["theWorstMSE", "bestMSE", "bestTreeTemp", "temperature"]:
+        arrays[name] = np.float64(result[name])
+    with open(path, 'wb') as f:
+        np.savez(f, **arrays)
+
+def loadTrace(path):
+    ''' Load a trace file written by saveTrace.
+    @return dictionary with keys of an annealing result'''
+    with np.load(path) as data:
+        result = {}
+        for name in data.files:
+            if data[name].ndim == 0:
+                result[name] = data[name].item()
+            else:
+                result[name] = data[name]
+    return result
+
+class ProgressLog(object):
+    ''' Prints progress of annealing at most once per interval seconds.'''
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.last = None
+
+    def log(self, steps, temp, mse, bestMSE):
+        now = time.time()
+        if self.last is None or now - self.last >= self.interval:
+            self.last = now
+            print ("Step: %d Temp: %s MSE: %s Best MSE: %s"
+                   % (steps, temp, mse, bestMSE))